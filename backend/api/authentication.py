@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram.metrics import registry
+from users.models import CustomUser
+
+# Поля пользователя в кэше в порядке полей модели (его ждет from_db);
+# остальные загружаются при обращении. Хэш пароля и счетчики в кэш не
+# попадают, а save() снимка пишет только загруженные поля.
+SNAPSHOT_FIELDS = (
+    'id', 'is_superuser', 'is_staff', 'is_active',
+    'email', 'username', 'first_name', 'last_name', 'role',
+)
+
+token_lookups = registry.counter(
+    'foodgram_token_auth_total',
+    'Token authentications by the cache layer that answered.',
+    ('result',),
+)
+
+
+class LocalCache:
+    """Ограниченный LRU-кэш процесса со сроком жизни записей."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, size):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+local_cache = LocalCache()
+
+
+def get_cache_key(token_key):
+    digest = hashlib.sha256(token_key.encode()).hexdigest()
+    return f'token-auth:{digest}'
+
+
+def get_shared_cache():
+    alias = settings.TOKEN_AUTH_CACHE['SHARED_CACHE']
+    return caches[alias] if alias else None
+
+
+def invalidate_tokens(token_keys):
+    """Удаляет токены из кэша этого процесса и общего кэша.
+
+    Локальные копии в других процессах истекают через LOCAL_TIMEOUT.
+    """
+    keys = [get_cache_key(token_key) for token_key in token_keys]
+    for key in keys:
+        local_cache.delete(key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None and keys:
+        shared_cache.delete_many(keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе на каждый вызов API.
+
+    Токен сопоставляется снимку пользователя в кэше процесса, затем
+    в общем кэше (если он настроен) и только потом ищется в базе.
+    """
+
+    def authenticate_credentials(self, key):
+        options = settings.TOKEN_AUTH_CACHE
+        cache_key = get_cache_key(key)
+        snapshot = local_cache.get(cache_key)
+        if snapshot is not None:
+            # Срок жизни локальной записи не продлевается, иначе выход
+            # в другом процессе не дошел бы до этого.
+            token_lookups.inc(result='local')
+            return self.get_user(key, snapshot)
+
+        shared_cache = get_shared_cache()
+        if shared_cache is not None:
+            snapshot = shared_cache.get(cache_key)
+        if snapshot is not None:
+            token_lookups.inc(result='shared')
+            user, token = self.get_user(key, snapshot)
+        else:
+            token_lookups.inc(result='miss')
+            user, token = super().authenticate_credentials(key)
+            snapshot = tuple(
+                getattr(user, field) for field in SNAPSHOT_FIELDS
+            )
+            if shared_cache is not None:
+                shared_cache.set(
+                    cache_key, snapshot, options['SHARED_TIMEOUT']
+                )
+        if options['LOCAL_TIMEOUT'] > 0:
+            local_cache.set(
+                cache_key, snapshot,
+                options['LOCAL_TIMEOUT'], options['LOCAL_SIZE'],
+            )
+        return user, token
+
+    def get_user(self, key, snapshot):
+        user = CustomUser.from_db(
+            router.db_for_write(CustomUser), SNAPSHOT_FIELDS, snapshot
+        )
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,133 @@
+import calendar
+import hashlib
+
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, parse_etags
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from recipes.catalog import get_catalog_cache, get_catalog_version
+from recipes.models import Recipe
+
+
+class CatalogCacheMixin:
+    """Кэширует готовые JSON-ответы справочников (теги, ингредиенты).
+
+    Ключ и ETag строятся из версии каталога и полного пути запроса,
+    поэтому любое изменение тегов или ингредиентов сбрасывает кэш.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        version = get_catalog_version()
+        digest = hashlib.sha256(
+            f'{version}:{request.get_full_path()}'.encode()
+        ).hexdigest()[:32]
+        etag = f'"{digest}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        cache = get_catalog_cache()
+        key = f'catalog-response:{digest}'
+        body = cache.get(key)
+        if body is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = JSONRenderer().render(response.data)
+            cache.set(key, body)
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+class RecipeDetailCacheMixin:
+    """Двухслойный кэш детального представления рецепта.
+
+    Общий слой — сериализованный рецепт в кэше 'recipes' под версиями
+    рецепта и каталога. Поверх него одним запросом к строке рецепта
+    накладываются данные, зависящие от пользователя и часто меняющиеся:
+    флаги избранного, списка покупок и подписки на автора и счетчики.
+    Тот же запрос дает версию для ETag и дату для Last-Modified.
+    """
+
+    overlay_fields = (
+        'is_favorited', 'is_in_shopping_cart',
+        'favorites_count', 'in_carts_count',
+    )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        state = get_object_or_404(
+            Recipe.objects.with_flags(request.user).values(
+                'version', 'updated_at', 'author_is_subscribed',
+                *self.overlay_fields,
+            ),
+            pk=self.kwargs[lookup_url_kwarg],
+        )
+        pk = self.kwargs[lookup_url_kwarg]
+        shared_key = hashlib.sha256(
+            f'{pk}:{state["version"]}:{get_catalog_version()}:'
+            f'{request.build_absolute_uri("/")}'.encode()
+        ).hexdigest()[:32]
+        overlay = ':'.join(
+            str(state[field]) for field in (
+                'author_is_subscribed', *self.overlay_fields
+            )
+        )
+        etag = '"%s"' % hashlib.sha256(
+            f'{shared_key}:{overlay}'.encode()
+        ).hexdigest()[:32]
+        last_modified = calendar.timegm(state['updated_at'].utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = Response(self.get_data(shared_key, state))
+        return self.set_validators(request, response, etag, last_modified)
+
+    def get_data(self, shared_key, state):
+        cache = caches['recipes']
+        key = f'recipe-detail:{shared_key}'
+        data = cache.get(key)
+        if data is None:
+            recipe = self.get_object()
+            data = self.get_serializer(recipe).data
+            # Рецепт мог измениться после чтения версии.
+            if recipe.version == state['version']:
+                cache.set(key, data)
+        data = dict(data)
+        data['author'] = dict(
+            data['author'], is_subscribed=state['author_is_subscribed']
+        )
+        data.update(
+            (field, state[field]) for field in self.overlay_fields
+        )
+        return data
+
+    def set_validators(self, request, response, etag, last_modified):
+        response['ETag'] = etag
+        # Last-Modified отражает изменение самого рецепта; флаги
+        # и счетчики проверяются только через ETag.
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response, no_cache=True,
+            private=request.user.is_authenticated,
+        )
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
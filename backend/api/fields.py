@@ -1,14 +1,80 @@
 import base64
+import binascii
 
+from django.conf import settings
 from django.core.files.base import ContentFile
 from rest_framework import serializers
 
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def sniff_image_format(head):
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение в data URI.
+
+    Размер проверяется до декодирования, формат определяется по первым
+    байтам, а не по заголовку data URI. Размер тела запроса целиком
+    ограничивает nginx (client_max_body_size).
+    """
+
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} МБ.',
+        'invalid_base64': 'Некорректное изображение в формате base64.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
+            data = self.decode(data)
         return super().to_internal_value(data)
+
+    def decode(self, data):
+        max_size = settings.RECIPE_IMAGES['MAX_UPLOAD_SIZE']
+        _, _, encoded = data.partition(';base64,')
+        if len(encoded) * 3 // 4 > max_size:
+            self.fail('too_large', max_size=max_size // (1024 * 1024))
+        # Без validate b64decode пропускает переводы строк сам, без
+        # лишней копии строки; мусор отсеивает проверка формата ниже.
+        try:
+            content = base64.b64decode(encoded)
+        except (binascii.Error, ValueError):
+            self.fail('invalid_base64')
+        ext = sniff_image_format(content[:16])
+        if ext is None:
+            self.fail('invalid_image')
+        return ContentFile(content, name=f'temp.{ext}')
+
+
+class RecipeImagesField(serializers.Field):
+    """Карта URL уменьшенных копий: {формат: {версия: url}}."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image_renditions')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, renditions):
+        storage = self.parent.Meta.model._meta.get_field('image').storage
+        request = self.context.get('request')
+        build_url = (
+            request.build_absolute_uri if request is not None else str
+        )
+        return {
+            image_format: {
+                name: build_url(storage.url(path))
+                for name, path in names.items()
+            }
+            for image_format, names in (renditions or {}).items()
+        }
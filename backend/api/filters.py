@@ -1,8 +1,10 @@
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend, SearchFilter
 
 from recipes import models
+from recipes.autocomplete import ingredient_index
+from recipes.search import search_recipes
 
 User = get_user_model()
 
@@ -10,6 +12,40 @@ User = get_user_model()
 class IngredientSearchFilter(SearchFilter):
     search_param = 'name'
 
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param, '')
+        if view.action == 'list' and name.strip():
+            return ingredient_index.search(name)
+        return super().filter_queryset(request, queryset, view)
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return search_recipes(queryset, query)
+
+
+class RecipeOrderingFilter(BaseFilterBackend):
+    """Сортировка по заранее посчитанным оценкам рецептов."""
+
+    ordering_param = 'ordering'
+    orderings = {
+        'popular': ('-popularity', '-id'),
+        'trending': ('-trending', '-id'),
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.orderings.get(
+            request.query_params.get(self.ordering_param)
+        )
+        if ordering is None:
+            return queryset
+        return queryset.order_by(*ordering)
+
 
 class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
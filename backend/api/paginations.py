@@ -1,6 +1,135 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.feed import apply_keyset
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(BasePagination):
+    """Keyset-пагинация по паре (ключ сортировки, id) без COUNT и OFFSET.
+
+    Ключ - pub_date или оценка из ``?ordering=``. Курсор хранит ключ
+    крайнего рецепта страницы, следующая страница выбирается условием
+    по индексу, поэтому глубина не влияет на время.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+    key_field = 'pub_date'
+    ordering_param = 'ordering'
+    ordering_fields = {
+        'popular': 'popularity',
+        'trending': 'trending',
+    }
+    # Релевантность поиска считается на каждый запрос и не хранится
+    # в индексе, поэтому ключом курсора быть не может.
+    search_param = 'search'
+    search_message = 'Результаты поиска не листаются курсором.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if request.query_params.get(self.search_param, '').strip():
+            raise ValidationError({self.search_param: self.search_message})
+        self.key_field = self.ordering_fields.get(
+            request.query_params.get(self.ordering_param), self.key_field
+        )
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        self.has_cursor = cursor is not None
+        self.reverse = self.has_cursor and cursor[2]
+        results = self.fetch(queryset, cursor, self.page_size + 1)
+        self.has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+        self.page = results
+        return results
+
+    def fetch(self, queryset, cursor, limit):
+        return list(
+            apply_keyset(queryset, cursor, key_field=self.key_field)[:limit]
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            key = self.parse_key(data['p'])
+            pk = int(data['i'])
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if key is None:
+            raise NotFound(self.invalid_cursor_message)
+        return key, pk, reverse
+
+    def parse_key(self, value):
+        if self.key_field == 'pub_date':
+            return parse_datetime(value)
+        if isinstance(value, bool):
+            raise TypeError
+        return float(value)
+
+    def encode_cursor(self, recipe, reverse=False):
+        key = getattr(recipe, self.key_field)
+        if self.key_field == 'pub_date':
+            key = key.isoformat()
+        data = {'p': key, 'i': recipe.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(data, separators=(',', ':')).encode()
+        ).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.page or not (self.has_more or self.reverse):
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        has_previous = self.has_more if self.reverse else self.has_cursor
+        if not self.page or not has_previous:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        )))
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """Курсорная пагинация ленты подписок (recipes.feed.Feed)."""
+
+    ordering_fields = {}
+    search_param = None
+
+    def fetch(self, feed, cursor, limit):
+        return feed.fetch(cursor, limit)
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import os
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ShoppingListContentNegotiation(DefaultContentNegotiation):
+    """Выбирает формат только по параметру ``?format=``.
+
+    Заголовок Accept игнорируется: без параметра отдается первый
+    рендерер из списка.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if format:
+            renderers = self.filter_renderers(renderers, format)
+        return renderers[0], renderers[0].media_type
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Через render() проходят только ответы с ошибками,
+        # сам список покупок отдается потоком из stream().
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """Отдает файл списка покупок частями в байтах."""
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for ingredient in ingredients:
+            yield (
+                f'{ingredient["name"]} - '
+                f'{ingredient["amount"]} '
+                f'{ingredient["measurement_unit"]}\n'
+            ).encode(self.charset)
+
+
+class EchoBuffer:
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Количество', 'Единица измерения')
+
+    def stream(self, ingredients):
+        writer = csv.writer(EchoBuffer())
+        yield '\ufeff'.encode(self.charset)
+        yield writer.writerow(self.header).encode(self.charset)
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['name'],
+                ingredient['amount'],
+                ingredient['measurement_unit'],
+            )).encode(self.charset)
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    title = 'Список покупок'
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+    line_height = 18
+
+    def get_font_name(self):
+        if self.font_name in pdfmetrics.getRegisteredFontNames():
+            return self.font_name
+        font_path = settings.SHOPPING_LIST_PDF_FONT
+        if not os.path.exists(font_path):
+            return 'Helvetica'
+        pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        return self.font_name
+
+    def stream(self, ingredients):
+        # PDF собирается reportlab целиком, но его размер ограничен
+        # числом разных ингредиентов, а не числом рецептов в корзине.
+        buffer = io.BytesIO()
+        font_name = self.get_font_name()
+        width, height = A4
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        pdf.setTitle(self.title)
+        pdf.setFont(font_name, self.font_size + 4)
+        pdf.drawString(self.margin, height - self.margin, self.title)
+        y = height - self.margin - self.line_height * 2
+        pdf.setFont(font_name, self.font_size)
+        for ingredient in ingredients:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font_name, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin, y,
+                f'{ingredient["name"]} - '
+                f'{ingredient["amount"]} '
+                f'{ingredient["measurement_unit"]}'
+            )
+            y -= self.line_height
+        pdf.save()
+        buffer.seek(0)
+        while chunk := buffer.read(CHUNK_SIZE):
+            yield chunk
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
@@ -1,12 +1,20 @@
+import os
+
 from django.db import transaction
+from django.db.models import F
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import Throttled, ValidationError
+from djoser.conf import settings as djoser_settings
+from djoser.serializers import TokenCreateSerializer as DjoserTokenCreate
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 
-from .fields import Base64ImageField
+from .fields import Base64ImageField, RecipeImagesField
 from recipes.models import (Ingredient, IngredientRecipe, Recipe, Favorites,
-                            ShoppingList, Tag)
-from users.models import CustomUser, Follow
+                            ShoppingList, ShoppingListIngredient, Tag)
+from recipes.images import schedule_renditions
+from recipes.storage import get_content_hash
+from users.models import CustomUser
+from users.passwords import LoginBusy, get_dummy_password, password_checker
 
 
 class UserSerializer(DjoserUserSerializer):
@@ -25,6 +33,8 @@ class UserSerializer(DjoserUserSerializer):
         )
 
     def get_is_subscribed(self, author):
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         user = self.context.get('request').user
 
         return (
@@ -33,17 +43,53 @@ class UserSerializer(DjoserUserSerializer):
         )
 
 
+class TokenCreateSerializer(DjoserTokenCreate):
+    """Вход по токену с проверкой пароля в пуле процессов.
+
+    Если пароль нужно пересчитать под текущий алгоритм, новый хэш
+    сохраняется здесь же.
+    """
+
+    def validate(self, attrs):
+        field = djoser_settings.LOGIN_FIELD
+        self.user = CustomUser.objects.filter(
+            **{field: attrs.get(field)}
+        ).first()
+        # Для несуществующего пользователя хэш тоже считается,
+        # чтобы время ответа не выдавало наличие адреса.
+        encoded = (
+            self.user.password if self.user else get_dummy_password()
+        )
+        try:
+            is_correct, updated = password_checker.check(
+                attrs.get('password') or '', encoded
+            )
+        except LoginBusy:
+            raise Throttled(
+                wait=1, detail='Слишком много попыток входа, повторите позже.'
+            )
+        if not (self.user and is_correct and self.user.is_active):
+            self.fail('invalid_credentials')
+        if updated:
+            self.user.password = updated
+            self.user.save(update_fields=('password',))
+        return attrs
+
+
 class RecipeFollowSerializer(serializers.ModelSerializer):
+    images = RecipeImagesField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class FollowSerializer(serializers.ModelSerializer):
-    is_subscribed = serializers.SerializerMethodField()
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    is_subscribed = serializers.BooleanField(read_only=True)
+    recipes = RecipeFollowSerializer(
+        source='recipes_preview', many=True, read_only=True
+    )
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = CustomUser
@@ -58,25 +104,6 @@ class FollowSerializer(serializers.ModelSerializer):
             'recipes_count',
         )
 
-    def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-
-        if user.is_authenticated:
-            return Follow.objects.filter(user=user, author=obj).exists()
-        return False
-
-    def get_recipes(self, user):
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=user)
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
-        serializer = RecipeFollowSerializer(recipes, many=True)
-        return serializer.data
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.id).count()
-
 
 class FavoritesSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(
@@ -166,12 +193,41 @@ class RecipeListSerializer(serializers.ModelSerializer):
         read_only=True,
         default=False
     )
+    images = RecipeImagesField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'name', 'image', 'images', 'text', 'cooking_time',
+                  'favorites_count', 'in_carts_count')
+
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'author_is_subscribed'):
+            recipe.author.is_subscribed = recipe.author_is_subscribed
+        return super().to_representation(recipe)
+
+
+class RecipeMatchSerializer(RecipeListSerializer):
+    matched_count = serializers.IntegerField(read_only=True)
+    missing_count = serializers.IntegerField(read_only=True)
+    match_ratio = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + (
+            'matched_count', 'missing_count', 'match_ratio',
+        )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def validate_recipes(self, recipes):
+        return list(dict.fromkeys(recipes))
 
 
 class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
@@ -218,19 +274,93 @@ class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
     def create(self, validate_data):
         ingredients = validate_data.pop('ingredients')
         tags = validate_data.pop('tags')
-        recipe = Recipe.objects.create(**validate_data)
+        recipe = Recipe.objects.create(
+            **validate_data, ingredients_count=len(ingredients)
+        )
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
+        schedule_renditions(recipe)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Пишет только отличия от сохраненных ингредиентов.
+
+        Возвращает True, если ингредиенты изменились.
+        """
+        rows = {
+            row.ingredient_id: row for row in recipe.ingredientrecipes.all()
+        }
+        old_amounts = {pk: row.amount for pk, row in rows.items()}
+        new_amounts = {i['ingredient'].id: i['amount'] for i in ingredients}
+        if old_amounts == new_amounts:
+            return False
+
+        removed = rows.keys() - new_amounts.keys()
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for pk, row in rows.items():
+            if pk in new_amounts and row.amount != new_amounts[pk]:
+                row.amount = new_amounts[pk]
+                changed.append(row)
+        IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [i for i in ingredients if i['ingredient'].id not in rows],
+            recipe,
+        )
+        ShoppingListIngredient.objects.update_recipe(
+            recipe, old_amounts, new_amounts
+        )
+        return True
+
+    def update_tags(self, recipe, tags):
+        old = set(recipe.tags.values_list('pk', flat=True))
+        new = {tag.pk for tag in tags}
+        if old - new:
+            recipe.tags.remove(*(old - new))
+        if new - old:
+            recipe.tags.add(*(new - old))
+        return old != new
+
+    def is_same_image(self, recipe, image):
+        stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+        return stem == get_content_hash(image)
+
     @transaction.atomic
     def update(self, recipe, validate_data):
-        ingredients = validate_data.pop('ingredients')
-        recipe.tags.clear()
-        recipe.ingredients.clear()
-        self.create_ingredients(recipe=recipe,
-                                ingredients=ingredients)
-        return super().update(recipe, validate_data)
+        ingredients = validate_data.pop('ingredients', None)
+        tags = validate_data.pop('tags', None)
+        related_changed = False
+        if ingredients is not None:
+            related_changed = self.update_ingredients(recipe, ingredients)
+            validate_data['ingredients_count'] = len(ingredients)
+        if tags is not None:
+            related_changed |= self.update_tags(recipe, tags)
+        image = validate_data.get('image')
+        if image is not None and self.is_same_image(recipe, image):
+            del validate_data['image']
+        elif image is not None:
+            validate_data['image_renditions'] = {}
+
+        changed = [
+            field for field, value in validate_data.items()
+            if field == 'image' or getattr(recipe, field) != value
+        ]
+        for field in changed:
+            setattr(recipe, field, validate_data[field])
+        if changed or related_changed:
+            # Новая версия сбрасывает кэш детального представления,
+            # сохранение переиндексирует рецепт для поиска.
+            recipe.version = F('version') + 1
+            recipe.save(update_fields=[*changed, 'version', 'updated_at'])
+        if 'image' in changed:
+            schedule_renditions(recipe)
+        return recipe
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_read_plan(
+            self.context['request'].user
+        ).get(pk=instance.pk)
         return RecipeListSerializer(instance, context=self.context).data
@@ -1,33 +1,107 @@
-import io
+from collections import defaultdict
 
-from django.http import FileResponse
-from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Exists, F, FloatField, OuterRef, Window
+from django.db.models.functions import Cast, NullIf, RowNumber
 
-from recipes.models import IngredientRecipe
+from recipes.models import IngredientRecipe, Recipe, ShoppingListIngredient
+from users.models import Follow
 
 
-def get_shopping_list(self, request, author) -> io.BytesIO:
-    ingredients = IngredientRecipe.objects.filter(
-        recipe__shopping_cart_recipe__author=author
-    ).values(
-        'ingredient__name', 'ingredient__measurement_unit'
-    ).annotate(
-        amounts=Sum('amount', distinct=True)).order_by('amounts')
+def annotate_subscriptions(queryset, user):
+    """Добавляет к авторам флаг подписки текущего пользователя."""
+    return queryset.annotate(
+        is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))
+        ),
+    )
+
 
-    shopping_list = ''
+def prefetch_recipes_preview(authors, recipes_limit=None):
+    """Загружает превью рецептов для всех авторов страницы одним запросом.
 
-    for ingredient in ingredients:
-        shopping_list += (
-            f'{ingredient["ingredient__name"]} - '
-            f'{ingredient["amounts"]} '
-            f'{ingredient["ingredient__measurement_unit"]}\n'
+    При заданном лимите рецепты нумеруются оконной функцией ROW_NUMBER
+    внутри каждого автора, и из базы выбираются только первые
+    ``recipes_limit`` строк на автора.
+    """
+    authors = list(authors)
+    recipes = Recipe.objects.filter(author__in=authors)
+    if recipes_limit is not None:
+        ranked, params = recipes.annotate(
+            preview_rank=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                # Как Recipe.Meta.ordering: при равных датах порядок
+                # задает id, иначе превью с лимитом и без расходятся.
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            )
+        ).order_by().query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({ranked}) ranked '
+            'WHERE ranked.preview_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.preview_rank',
+            (*params, recipes_limit),
         )
-    filename = 'shopping_list.txt'
-    response = FileResponse(
-        shopping_list,
-        as_attachment=True,
-        filename=filename,
-        content_type='text/plain'
+
+    recipes_by_author = defaultdict(list)
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipes_preview = recipes_by_author[author.pk]
+    return authors
+
+
+def match_recipes(user, ingredient_ids, limit):
+    """Рецепты, лучше всего покрываемые имеющимися ингредиентами.
+
+    Совпадения считаются одним сгруппированным запросом только по строкам
+    IngredientRecipe с переданными ингредиентами (покрывающий индекс
+    по ingredient), а общее число ингредиентов берется из счетчика
+    Recipe.ingredients_count.
+    """
+    stats = IngredientRecipe.objects.filter(
+        ingredient__in=ingredient_ids
+    ).values('recipe').annotate(
+        matched_count=Count('pk'),
+    ).annotate(
+        missing_count=F('recipe__ingredients_count') - F('matched_count'),
+        match_ratio=(
+            Cast('matched_count', FloatField())
+            / NullIf('recipe__ingredients_count', 0)
+        ),
+    ).order_by('-match_ratio', 'missing_count', '-recipe')[:limit]
+    stats = {row['recipe']: row for row in stats}
+
+    recipes = Recipe.objects.with_read_plan(user).in_bulk(stats)
+    matches = []
+    for recipe_id, row in stats.items():
+        recipe = recipes.get(recipe_id)
+        if recipe is not None:
+            recipe.matched_count = row['matched_count']
+            recipe.missing_count = row['missing_count']
+            recipe.match_ratio = row['match_ratio']
+            matches.append(recipe)
+    return matches
+
+
+def get_shopping_list_ingredients(author):
+    return ShoppingListIngredient.objects.filter(
+        author=author
+    ).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+    ).order_by('name')
+
+
+def get_shopping_list(author, renderer):
+    ingredients = get_shopping_list_ingredients(author).iterator()
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    response = StreamingHttpResponse(
+        renderer.stream(ingredients), content_type=content_type
     )
+    filename = f'shopping_list.{renderer.format}'
     response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
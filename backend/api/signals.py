@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.models import CustomUser
+
+from .authentication import invalidate_tokens
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=CustomUser)
+def forget_user_tokens(instance, created, update_fields, **kwargs):
+    # Вход обновляет только last_login, снимок от него не зависит.
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_tokens(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
@@ -0,0 +1,1046 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import local_cache
+from api.serializers import CreateUpdateRecipeSerializer
+from recipes.autocomplete import IngredientIndex
+from recipes.catalog import catalog_version, get_catalog_version
+
+from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingList, ShoppingListIngredient, Tag)
+from recipes.feed import add_author
+from recipes.search import index_recipes
+from users.models import CustomUser, Follow
+
+IMAGE = 'recipes/images/test.png'
+
+
+def create_users(prefix, count):
+    return [
+        CustomUser.objects.create(
+            email=f'{prefix}{i}@example.com',
+            username=f'{prefix}{i}',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        for i in range(count)
+    ]
+
+
+def create_recipes(authors, per_author, ingredients=(), tags=()):
+    CustomUser.objects.filter(pk__in=[author.pk for author in authors]).update(
+        recipes_count=F('recipes_count') + per_author
+    )
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author,
+            name=f'Рецепт {i}',
+            image=IMAGE,
+            text='Описание',
+            cooking_time=10,
+            ingredients_count=len(ingredients),
+        )
+        for author in authors
+        for i in range(per_author)
+    )
+    recipes = list(Recipe.objects.filter(author__in=authors))
+    IngredientRecipe.objects.bulk_create(
+        IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+        for recipe in recipes
+        for ingredient in ingredients
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe=recipe, tag=tag)
+        for recipe in recipes
+        for tag in tags
+    )
+    return recipes
+
+
+class SubscriptionsQueriesTest(TestCase):
+    """Страница подписок читается за фиксированное число запросов."""
+
+    # Счетчик страницы, сама страница и превью рецептов всех авторов.
+    QUERIES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('reader', 1)
+        authors = create_users('author', 60)
+        Follow.objects.bulk_create(
+            Follow(user=cls.user, author=author) for author in authors
+        )
+        create_recipes(authors, 4)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_subscriptions(self, **params):
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get('/api/users/subscriptions/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                results = self.get_subscriptions(limit=limit)
+                self.assertEqual(len(results), limit)
+                self.assertTrue(all(
+                    len(author['recipes']) == 4 for author in results
+                ))
+
+    def test_query_count_with_recipes_limit(self):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                results = self.get_subscriptions(
+                    limit=limit, recipes_limit=2
+                )
+                self.assertEqual(len(results), limit)
+                self.assertTrue(all(
+                    len(author['recipes']) == 2
+                    and author['recipes_count'] == 4
+                    for author in results
+                ))
+
+    def test_preview_order_with_equal_dates(self):
+        Recipe.objects.update(pub_date=Recipe.objects.first().pub_date)
+        full = self.client.get(
+            '/api/users/subscriptions/', {'limit': 6}
+        ).data['results']
+        limited = self.get_subscriptions(limit=6, recipes_limit=2)
+        for author, preview in zip(full, limited):
+            self.assertEqual(
+                [recipe['id'] for recipe in preview['recipes']],
+                [recipe['id'] for recipe in author['recipes'][:2]],
+            )
+
+
+class RecipeQueriesTest(TestCase):
+    """Рецепты читаются за фиксированное число запросов, сколько бы их
+    ни было на странице и сколько бы у них ни было ингредиентов и тегов.
+    """
+
+    # Рецепты с автором и флагами, теги и ингредиенты.
+    RECIPES_QUERIES = 3
+    # Счетчик страницы и рецепты.
+    LIST_QUERIES = 1 + RECIPES_QUERIES
+    # Версия и флаги рецепта и сам рецепт при промахе кэша.
+    RETRIEVE_QUERIES = 1 + RECIPES_QUERIES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('reader', 1)
+        authors = create_users('author', 6)
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(5)
+        ]
+        cls.small = create_recipes(authors[:1], 1, ingredients[:1], tags[:1])
+        cls.large = create_recipes(authors[1:], 12, ingredients, tags)
+        Follow.objects.create(user=cls.user, author=authors[1])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        caches['recipes'].clear()
+        catalog_version.reset()
+        get_catalog_version()
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        for limit in (1, 6, 50):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': limit}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_retrieve_query_count_does_not_depend_on_recipe_size(self):
+        for recipe in (self.small[0], self.large[0]):
+            with self.subTest(ingredients=recipe.ingredients_count):
+                with self.assertNumQueries(self.RETRIEVE_QUERIES):
+                    response = self.client.get(f'/api/recipes/{recipe.pk}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    len(response.data['ingredients']),
+                    recipe.ingredients_count,
+                )
+
+    def test_write_representation_query_count(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        for recipe in (self.small[0], self.large[0]):
+            with self.subTest(ingredients=recipe.ingredients_count):
+                serializer = CreateUpdateRecipeSerializer(
+                    recipe, context={'request': request}
+                )
+                with self.assertNumQueries(self.RECIPES_QUERIES):
+                    data = serializer.data
+                self.assertEqual(
+                    len(data['ingredients']), recipe.ingredients_count
+                )
+
+
+class RecipeCursorPaginationTest(TestCase):
+    """Курсор проходит список без пропусков и повторов, в том числе
+    среди рецептов с одинаковым ключом сортировки.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = create_users('user', 1)
+        cls.recipes = create_recipes(authors, 5)
+        Recipe.objects.update(pub_date=cls.recipes[0].pub_date)
+        for popularity, recipe in zip((3, 1, 3, 2, 1), cls.recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(popularity=popularity)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def walk(self, url):
+        ids = []
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids, pages
+
+    def test_pub_date(self):
+        ids, pages = self.walk('/api/recipes/?pagination=cursor&limit=2')
+        self.assertEqual(ids, list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True)))
+        self.assertNotIn('count', pages[0])
+        previous = self.client.get(pages[1]['previous']).data
+        self.assertEqual(previous['results'], pages[0]['results'])
+        self.assertIsNone(previous['previous'])
+
+    def test_popularity(self):
+        ids, _ = self.walk(
+            '/api/recipes/?pagination=cursor&limit=2&ordering=popular'
+        )
+        self.assertEqual(ids, list(Recipe.objects.order_by(
+            '-popularity', '-id'
+        ).values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_is_rejected(self):
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&search=рецепт'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('search', response.data)
+
+
+class RecipeSearchTest(TestCase):
+    """Полнотекстовый поиск: совпадение в названии важнее совпадения
+    в ингредиентах, а оно важнее совпадения в описании.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        (author,) = create_users('user', 1)
+        cls.chocolate = Ingredient.objects.create(
+            name='Шоколад', measurement_unit='г'
+        )
+        cls.in_name, cls.in_ingredients, cls.in_text, cls.other = (
+            create_recipes([author], 4)
+        )
+        cls.in_text.text = 'Подавать с шоколадом'
+        cls.in_name.name = 'Шоколадный торт'
+        # Порядок по дате публикации обратен ожидаемому порядку по рангу.
+        for minutes, recipe in enumerate(
+            (cls.in_name, cls.in_ingredients, cls.in_text)
+        ):
+            recipe.pub_date += timedelta(minutes=minutes)
+        Recipe.objects.bulk_update(
+            [cls.in_name, cls.in_ingredients, cls.in_text],
+            ['name', 'text', 'pub_date'],
+        )
+        IngredientRecipe.objects.create(
+            recipe=cls.in_ingredients, ingredient=cls.chocolate, amount=10
+        )
+        index_recipes()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_ranking(self):
+        self.assertEqual(
+            self.search('шоколад'),
+            [self.in_name.pk, self.in_ingredients.pk, self.in_text.pk],
+        )
+
+    def test_no_words(self):
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_ingredient_rename_reindexes(self):
+        self.chocolate.name = 'Какао'
+        self.chocolate.save()
+        self.assertEqual(self.search('какао'), [self.in_ingredients.pk])
+
+    def test_recipe_save_and_delete(self):
+        self.other.name = 'Шоколадное печенье'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.save()
+        self.assertIn(self.other.pk, self.search('шоколад'))
+        self.other.delete()
+        self.assertNotIn(self.other.pk, self.search('шоколад'))
+
+
+class RecipeMatchTest(TestCase):
+    """Подбор рецептов по имеющимся ингредиентам: сначала рецепты с
+    большей долей имеющихся ингредиентов.
+    """
+
+    url = '/api/recipes/match/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.flour, cls.egg, cls.milk, cls.salt = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Яйцо', 'Молоко', 'Соль')
+        )
+        authors = create_users('user', 4)
+        ((cls.full,), (cls.half,), (cls.third,), (cls.none,)) = (
+            create_recipes([author], 1, ingredients)
+            for author, ingredients in zip(authors, (
+                (cls.flour, cls.egg),
+                (cls.flour, cls.milk),
+                (cls.flour, cls.milk, cls.salt),
+                (cls.salt,),
+            ))
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def match(self, *ingredients, **params):
+        response = self.client.get(self.url, {
+            'ingredients': [ingredient.pk for ingredient in ingredients],
+            **params,
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_order(self):
+        data = self.match(self.flour, self.egg)
+        self.assertEqual(
+            [recipe['id'] for recipe in data],
+            [self.full.pk, self.half.pk, self.third.pk],
+        )
+        self.assertEqual(
+            [(recipe['matched_count'], recipe['missing_count'])
+             for recipe in data],
+            [(2, 0), (1, 1), (1, 2)],
+        )
+        self.assertEqual(data[1]['match_ratio'], 0.5)
+
+    def test_limit(self):
+        data = self.match(self.flour, self.egg, limit=1)
+        self.assertEqual([recipe['id'] for recipe in data], [self.full.pk])
+
+    def test_invalid_ingredients(self):
+        for params in ({}, {'ingredients': 'мука'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+
+class BulkConnectionsTest(TestCase):
+    """Массовое добавление и удаление избранного и корзины."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.user = create_users('user', 2)
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipes = create_recipes([cls.author], 3, [cls.ingredient])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, method, url, ids):
+        response = getattr(self.client, method)(
+            url, {'recipes': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (result['id'], result['status'])
+            for result in response.data['results']
+        ]
+
+    def test_favorite(self):
+        first, second, _ = (recipe.pk for recipe in self.recipes)
+        missing = 10 ** 6
+        url = '/api/recipes/favorite/'
+        self.bulk('post', url, [first])
+        self.assertEqual(
+            self.bulk('post', url, [first, second, missing, second]),
+            [(first, 'exists'), (second, 'added'), (missing, 'not_found')],
+        )
+        self.assertEqual(
+            Recipe.objects.get(pk=second).favorites_count, 1
+        )
+        self.assertEqual(
+            self.bulk('delete', url, [first, missing]),
+            [(first, 'removed'), (missing, 'missing')],
+        )
+        self.assertEqual(
+            list(Favorites.objects.values_list('recipe_id', flat=True)),
+            [second],
+        )
+        self.assertEqual(Recipe.objects.get(pk=first).favorites_count, 0)
+
+    def test_shopping_cart(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        url = '/api/recipes/shopping_cart/'
+        self.bulk('post', url, ids)
+        self.assertEqual(
+            ShoppingListIngredient.objects.get(author=self.user).amount, 30
+        )
+        self.assertEqual(
+            set(Recipe.objects.values_list('in_carts_count', flat=True)),
+            {1},
+        )
+        self.bulk('delete', url, ids[:2])
+        self.assertEqual(
+            ShoppingListIngredient.objects.get(author=self.user).amount, 10
+        )
+
+    def test_limit(self):
+        response = self.client.post(
+            '/api/recipes/favorite/',
+            {'recipes': list(range(1, 102))},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/recipes/favorite/', {'recipes': []}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeUpdateTest(TestCase):
+    """Обновление рецепта пишет только отличия и меняет версию, только
+    если рецепт изменился.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        (cls.author,) = create_users('user', 1)
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(3)
+        ]
+        (cls.recipe,) = create_recipes(
+            [cls.author], 1, cls.ingredients[:2], cls.tags[:1]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def patch(self, amounts, tags):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {
+                'tags': [tag.pk for tag in tags],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in amounts
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def get_rows(self):
+        return dict(IngredientRecipe.objects.filter(
+            recipe=self.recipe
+        ).values_list('ingredient_id', 'id'))
+
+    def get_version(self):
+        return Recipe.objects.get(pk=self.recipe.pk).version
+
+    def test_unchanged_recipe_is_not_written(self):
+        version = self.get_version()
+        with CaptureQueriesContext(connection) as context:
+            self.patch(
+                [(self.ingredients[0], 10), (self.ingredients[1], 10)],
+                self.tags[:1],
+            )
+        writes = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+        self.assertEqual(writes, [])
+        self.assertEqual(self.get_version(), version)
+
+    def test_ingredients_diff(self):
+        rows = self.get_rows()
+        version = self.get_version()
+        self.patch(
+            [(self.ingredients[0], 15), (self.ingredients[2], 5)],
+            self.tags[:1],
+        )
+        new_rows = self.get_rows()
+        self.assertEqual(
+            new_rows.keys(), {self.ingredients[0].pk, self.ingredients[2].pk}
+        )
+        self.assertEqual(
+            new_rows[self.ingredients[0].pk], rows[self.ingredients[0].pk]
+        )
+        self.assertEqual(
+            IngredientRecipe.objects.get(
+                pk=rows[self.ingredients[0].pk]
+            ).amount,
+            15,
+        )
+        self.assertEqual(self.get_version(), version + 1)
+
+    def test_tags_change_bumps_version(self):
+        version = self.get_version()
+        self.patch(
+            [(self.ingredients[0], 10), (self.ingredients[1], 10)],
+            self.tags[1:],
+        )
+        self.assertEqual(
+            list(self.recipe.tags.values_list('pk', flat=True)),
+            [self.tags[1].pk],
+        )
+        self.assertEqual(self.get_version(), version + 1)
+
+
+class RecipeDetailCacheTest(TestCase):
+    """Детальное представление рецепта: условные запросы и флаги
+    пользователя поверх общего кэша.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader, cls.other = create_users('user', 3)
+        cls.tag = Tag.objects.create(
+            name='Тег', color='#000000', slug='tag'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        (cls.recipe,) = create_recipes(
+            [cls.author], 1, [cls.ingredient], [cls.tag]
+        )
+        cls.url = f'/api/recipes/{cls.recipe.pk}/'
+
+    def setUp(self):
+        caches['recipes'].clear()
+        self.client = APIClient()
+
+    def get(self, user, **headers):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url, **headers)
+
+    def test_not_modified(self):
+        etag = self.get(self.reader)['ETag']
+        response = self.get(self.reader, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.client.post(f'{self.url}favorite/')
+        response = self.get(self.reader, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertEqual(response.data['favorites_count'], 1)
+
+    def test_overlay_is_per_user(self):
+        self.client.force_authenticate(self.reader)
+        self.client.post(f'{self.url}favorite/')
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        response = self.get(self.reader)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        response = self.get(self.other)
+        self.assertFalse(response.data['is_favorited'])
+        self.assertFalse(response.data['author']['is_subscribed'])
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.assertNotEqual(response['ETag'], self.get(self.reader)['ETag'])
+
+    def test_update_invalidates(self):
+        etag = self.get(self.reader)['ETag']
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            self.url,
+            {
+                'name': 'Новое название',
+                'tags': [self.tag.pk],
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.get(self.reader, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Новое название')
+
+
+class ShoppingListIngredientTest(TestCase):
+    """Суммы ингредиентов списка покупок совпадают с пересчетом по
+    рецептам в корзине, как бы ни менялись корзина и рецепты.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.buyer, cls.other = create_users('user', 3)
+        cls.tag = Tag.objects.create(
+            name='Тег', color='#000000', slug='tag'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(3)
+        ]
+        cls.recipes = create_recipes(
+            [cls.author], 3, cls.ingredients[:2], [cls.tag]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def add_to_cart(self, user, recipe):
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            f'/api/recipes/{recipe.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def assertMatchesLive(self):
+        self.assertCountEqual(
+            ShoppingListIngredient.objects.values_list(
+                'author', 'ingredient', 'amount'
+            ),
+            list(ShoppingListIngredient.objects.live()),
+        )
+
+    def test_add(self):
+        for user in (self.buyer, self.other):
+            for recipe in self.recipes[:2]:
+                self.add_to_cart(user, recipe)
+        self.assertEqual(
+            ShoppingListIngredient.objects.get(
+                author=self.buyer, ingredient=self.ingredients[0]
+            ).amount,
+            20,
+        )
+        self.assertMatchesLive()
+
+    def test_remove(self):
+        for recipe in self.recipes[:2]:
+            self.add_to_cart(self.buyer, recipe)
+        response = self.client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertMatchesLive()
+        self.client.delete(
+            f'/api/recipes/{self.recipes[1].pk}/shopping_cart/'
+        )
+        self.assertFalse(ShoppingListIngredient.objects.exists())
+
+    def test_recipe_edit(self):
+        recipe = self.recipes[0]
+        self.add_to_cart(self.buyer, recipe)
+        self.add_to_cart(self.other, recipe)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': self.ingredients[0].pk, 'amount': 25},
+                    {'id': self.ingredients[2].pk, 'amount': 5},
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertMatchesLive()
+
+    def test_recipe_delete(self):
+        for user in (self.buyer, self.other):
+            for recipe in self.recipes[:2]:
+                self.add_to_cart(user, recipe)
+        # Через ORM, как удаляет админка: в обход RecipeViewSet.
+        self.recipes[0].delete()
+        self.assertMatchesLive()
+        Recipe.objects.filter(pk=self.recipes[1].pk).delete()
+        self.assertFalse(ShoppingListIngredient.objects.exists())
+
+
+class ShoppingListDownloadTest(TestCase):
+    """Список покупок выгружается в txt, csv и pdf с суммами по всем
+    рецептам корзины.
+    """
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        (cls.buyer,) = create_users('user', 1)
+        ingredients = [
+            Ingredient.objects.create(name='Сахар', measurement_unit='г'),
+            Ingredient.objects.create(name='Молоко', measurement_unit='мл'),
+        ]
+        client = APIClient()
+        client.force_authenticate(cls.buyer)
+        for recipe in create_recipes([cls.buyer], 2, ingredients):
+            client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_txt_by_default(self):
+        response, content = self.download()
+        self.assertEqual(
+            response['Content-Type'], 'text/plain; charset=utf-8'
+        )
+        self.assertEqual(
+            content.decode(), 'Молоко - 20 мл\nСахар - 20 г\n'
+        )
+
+    def test_accept_header_is_ignored(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/pdf')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_csv(self):
+        response, content = self.download(format='csv')
+        self.assertIn('filename=shopping_list.csv',
+                      response['Content-Disposition'])
+        self.assertEqual(
+            content.decode('utf-8-sig').splitlines(),
+            [
+                'Ингредиент,Количество,Единица измерения',
+                'Молоко,20,мл',
+                'Сахар,20,г',
+            ],
+        )
+
+    def test_pdf(self):
+        response, content = self.download(format='pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+
+class CountersTest(TestCase):
+    """Счетчики сходятся и при изменениях через ORM, в обход API."""
+
+    def setUp(self):
+        self.author, self.reader, self.other = create_users('user', 3)
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.author, name=f'Рецепт {i}', image=IMAGE,
+                text='Описание', cooking_time=10,
+            )
+            for i in range(2)
+        ]
+        for user in (self.reader, self.other):
+            Follow.objects.create(user=user, author=self.author)
+            for recipe in self.recipes:
+                Favorites.objects.create(author=user, recipe=recipe)
+                ShoppingList.objects.create(author=user, recipe=recipe)
+
+    def assertCounters(self, recipes_count, followers_count, connections):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, recipes_count)
+        self.assertEqual(self.author.followers_count, followers_count)
+        for recipe in Recipe.objects.all():
+            self.assertEqual(recipe.favorites_count, connections)
+            self.assertEqual(recipe.in_carts_count, connections)
+
+    def test_create(self):
+        self.assertCounters(2, 2, 2)
+
+    def test_delete_connections(self):
+        Favorites.objects.filter(author=self.reader).delete()
+        ShoppingList.objects.filter(author=self.reader).delete()
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertCounters(2, 1, 1)
+
+    def test_delete_recipe(self):
+        self.recipes[0].delete()
+        self.assertCounters(1, 2, 2)
+
+    def test_delete_user(self):
+        self.other.delete()
+        self.assertCounters(2, 1, 1)
+
+
+class FeedBackfillTest(TestCase):
+    """Рецепты автора, опубликованные, пока у него было больше
+    FANOUT_LIMIT подписчиков, остаются в ленте и после отписок.
+    """
+
+    def setUp(self):
+        self.author, self.reader, self.other = create_users('user', 3)
+        self.client = APIClient()
+        for user in (self.reader, self.other):
+            self.client.force_authenticate(user)
+            self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image=IMAGE,
+            text='Описание', cooking_time=10,
+        )
+
+    def get_feed(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    @override_settings(FEED={'FANOUT_LIMIT': 1, 'MAX_LENGTH': 500,
+                             'TRIM_EVERY': 20})
+    def test_unsubscribe_below_limit(self):
+        self.assertEqual(self.get_feed(self.reader), [self.recipe.pk])
+        self.client.force_authenticate(self.other)
+        response = self.client.delete(
+            f'/api/users/{self.author.pk}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_feed(self.reader), [self.recipe.pk])
+        self.assertEqual(self.get_feed(self.other), [])
+
+
+@override_settings(PROFILING={
+    **settings.PROFILING,
+    'METRICS_TOKEN': 'secret',
+    'METRICS_ALLOWED_IPS': ['203.0.113.0/24'],
+})
+class MetricsAccessTest(TestCase):
+    """Доступ к /api/_metrics не выдается по адресу прокси."""
+
+    url = '/api/_metrics'
+
+    def test_proxy_address_is_not_trusted(self):
+        response = self.client.get(self.url, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_forwarded_address(self):
+        response = self.client.get(
+            self.url, HTTP_X_FORWARDED_FOR='203.0.113.7'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_spoofed_forwarded_address(self):
+        response = self.client.get(
+            self.url, HTTP_X_FORWARDED_FOR='203.0.113.7, 198.51.100.1'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_token(self):
+        response = self.client.get(
+            self.url, HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            self.url, HTTP_AUTHORIZATION='Bearer wrong'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff(self):
+        user = CustomUser.objects.create(
+            email='admin@example.com', username='admin', is_staff=True
+        )
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class IngredientIndexTest(TestCase):
+    """Короткие запросы не перебирают весь каталог."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('сахар', 'соль', 'мука', 'сахарная пудра', 'рис')
+        )
+
+    def search(self, query):
+        return [
+            ingredient.name
+            for ingredient in IngredientIndex().search(query, limit=10)
+        ]
+
+    def test_one_character_matches_prefix_only(self):
+        self.assertEqual(self.search('с'), ['сахар', 'сахарная пудра',
+                                            'соль'])
+
+    def test_two_characters_use_bigrams(self):
+        self.assertEqual(self.search('ар'), ['сахар', 'сахарная пудра'])
+        self.assertEqual(self.search('уд'), ['сахарная пудра'])
+
+    def test_trigrams(self):
+        self.assertEqual(self.search('пудр'), ['сахарная пудра'])
+
+
+@override_settings(TOKEN_AUTH_CACHE={
+    **settings.TOKEN_AUTH_CACHE, 'SHARED_CACHE': 'default',
+})
+class TokenCacheTest(TestCase):
+    """Кэш токенов снимает запрос к базе, но выход и деактивация
+    действуют сразу.
+    """
+
+    url = '/api/users/me/'
+
+    def setUp(self):
+        local_cache.entries.clear()
+        caches['default'].clear()
+        (self.user,) = create_users('user', 1)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def get_token_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            query for query in context.captured_queries
+            if 'authtoken_token' in query['sql']
+        ]
+
+    def test_cached(self):
+        self.assertEqual(len(self.get_token_queries()), 1)
+        self.assertEqual(self.get_token_queries(), [])
+        local_cache.entries.clear()
+        self.assertEqual(self.get_token_queries(), [])
+
+    def test_logout(self):
+        self.client.get(self.url)
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class QueryCollector:
+    """execute_wrapper: запоминает SELECT-запросы вместе с параметрами."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    prefix = (
+        'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+
+class QueryPlanTest(TestCase):
+    """Горячие запросы читают таблицы через рассчитанные на них индексы."""
+
+    ENDPOINTS = (
+        ('/api/recipes/', 'recipe_pub_date_idx'),
+        ('/api/recipes/?page=3', 'recipe_pub_date_idx'),
+        ('/api/recipes/?pagination=cursor', 'recipe_pub_date_idx'),
+        ('/api/recipes/?ordering=popular', 'recipe_popularity_idx'),
+        (
+            '/api/recipes/?ordering=trending&pagination=cursor',
+            'recipe_trending_idx',
+        ),
+        ('/api/recipes/?author={author}', 'recipe_author_pub_date_idx'),
+        (
+            '/api/users/subscriptions/?recipes_limit=3',
+            'recipe_author_pub_date_idx',
+        ),
+        ('/api/recipes/feed/', 'timeline_user_pub_date_idx'),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('reader', 1)
+        cls.authors = create_users('author', 5)
+        create_recipes(cls.authors, 5)
+        for author in cls.authors:
+            Follow.objects.create(user=cls.user, author=author)
+            add_author(cls.user, author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_endpoints_use_indexes(self):
+        for path, index in self.ENDPOINTS:
+            path = path.format(author=self.authors[0].pk)
+            with self.subTest(path=path):
+                collector = QueryCollector()
+                with connection.execute_wrapper(collector):
+                    response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                plans = [explain(*query) for query in collector.queries]
+                self.assertTrue(
+                    any(index in plan for plan in plans),
+                    '\n\n'.join(plans),
+                )
+
+    def test_ingredient_prefix_search_uses_index(self):
+        # Так фильтрует SearchFilter с search_fields = ('^name',).
+        plan = explain(*Ingredient.objects.filter(
+            name__istartswith='мо'
+        ).query.sql_with_params())
+        self.assertIn('ingredient_name_prefix_idx', plan)
@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.db.models import F
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -5,12 +7,20 @@ from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from djoser.views import UserViewSet
 
+from foodgram.db import ReplicaReadMixin
+from recipes.feed import Feed, add_author, fan_out_recipe, remove_author
 from recipes.models import (Ingredient, Recipe, Favorites,
-                            ShoppingList, Tag)
+                            ShoppingList, ShoppingListIngredient, Tag,
+                            lock_authors)
 from users.models import CustomUser, Follow
-from api.filters import RecipeFilter, IngredientSearchFilter
+from api.cache import CatalogCacheMixin, RecipeDetailCacheMixin
+from api.filters import (RecipeFilter, RecipeOrderingFilter,
+                         RecipeSearchFilter, IngredientSearchFilter)
 from api.permissions import IsAuthorOrReadOnly
-from api.services import get_shopping_list
+from api.renderers import (SHOPPING_LIST_RENDERERS,
+                           ShoppingListContentNegotiation)
+from api.services import (annotate_subscriptions, get_shopping_list,
+                          match_recipes, prefetch_recipes_preview)
 from . import paginations, serializers
 
 
@@ -37,6 +47,12 @@ class UserViewSet(UserViewSet):
             return serializers.FollowSerializer
         return super().get_serializer_class()
 
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            return int(recipes_limit)
+        return None
+
     @action(detail=True, methods=('post',), pagination_class=None)
     def subscribe(self, request, id):
         if not CustomUser.objects.filter(pk=id).exists():
@@ -61,9 +77,15 @@ class UserViewSet(UserViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        Follow.objects.create(user=user, author=author)
+        with transaction.atomic():
+            Follow.objects.create(user=user, author=author)
+            add_author(user, author)
+        author = annotate_subscriptions(
+            CustomUser.objects.filter(pk=author.pk), user
+        )
         serializer = serializers.FollowSerializer(
-            author, context={'request': request}
+            prefetch_recipes_preview(author, self.get_recipes_limit())[0],
+            context={'request': request}
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -82,7 +104,9 @@ class UserViewSet(UserViewSet):
 
         connection = Follow.objects.filter(user=user, author=author)
         if connection.exists():
-            connection.delete()
+            with transaction.atomic():
+                connection.delete()
+                remove_author(user, author)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(
@@ -95,23 +119,34 @@ class UserViewSet(UserViewSet):
         pagination_class=paginations.LimitPageNumberPagination,
     )
     def subscriptions(self, request):
-        queryset = CustomUser.objects.filter(author__user=self.request.user)
+        queryset = annotate_subscriptions(
+            CustomUser.objects.filter(
+                author__user=request.user
+            ).order_by('id'),
+            request.user,
+        )
         serializer = serializers.FollowSerializer(
-            self.paginate_queryset(queryset),
+            prefetch_recipes_preview(
+                self.paginate_queryset(queryset), self.get_recipes_limit()
+            ),
             context=dict(request=request),
             many=True,
         )
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(
+    ReplicaReadMixin, CatalogCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
     permission_classes = (AllowAny, )
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    ReplicaReadMixin, CatalogCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
     permission_classes = (AllowAny, )
@@ -120,60 +155,136 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ReplicaReadMixin, RecipeDetailCacheMixin, viewsets.ModelViewSet
+):
     permission_classes = (IsAuthorOrReadOnly,)
     filterset_class = RecipeFilter
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (
+        DjangoFilterBackend, RecipeSearchFilter, RecipeOrderingFilter
+    )
     pagination_class = paginations.LimitPageNumberPagination
     http_method_names = ['get', 'post', 'delete', 'patch']
 
     def get_queryset(self):
-        user = self.request.user
-        if user and user.is_authenticated:
-            return Recipe.objects.with_annotations(user).select_related(
-                'author'
-            )
-        return Recipe.objects.select_related('author').prefetch_related('tags')
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.with_read_plan(self.request.user)
+        return Recipe.objects.all()
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = paginations.RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return serializers.RecipeListSerializer
         return serializers.CreateUpdateRecipeSerializer
 
+    counter_fields = {
+        Favorites: 'favorites_count',
+        ShoppingList: 'in_carts_count',
+    }
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        fan_out_recipe(recipe)
 
+    def update_counter(self, model, pks, delta):
+        field = self.counter_fields[model]
+        Recipe.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+    @transaction.atomic
     def create_connection(self, model, user, pk):
-        if not Recipe.objects.filter(id=pk).exists():
+        recipe = Recipe.objects.filter(pk=pk).first()
+        if recipe is None:
             return Response(
                 {'errors': 'Рецепт не существует!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        if model.objects.filter(author=user, recipe__id=pk).exists():
+        lock_authors([user.pk])
+        _, created = model.objects.get_or_create(author=user, recipe=recipe)
+        if not created:
             return Response(
                 {'errors': 'Рецепт уже в списке!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        recipe = Recipe.objects.get(pk=pk)
-        model.objects.create(author=user, recipe=recipe)
+        if model is ShoppingList:
+            ShoppingListIngredient.objects.add_recipes(user.pk, [recipe])
         serializer = serializers.RecipeFollowSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def delete_connection(self, model, user, pk):
+        lock_authors([user.pk])
+        deleted, _ = model.objects.filter(author=user, recipe_id=pk).delete()
+        if deleted:
+            return Response(status=status.HTTP_204_NO_CONTENT)
         if not Recipe.objects.filter(id=pk).exists():
             return Response(
                 {'errors': 'Рецепт не существует!'},
                 status=status.HTTP_404_NOT_FOUND
             )
-        connection = model.objects.filter(author=user, recipe__id=pk)
-        if connection.exists():
-            connection.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'Рецепт был удален ранее!'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def get_bulk_ids(self, request):
+        serializer = serializers.RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    @transaction.atomic
+    def bulk_create_connections(self, model, user, ids):
+        found = set(Recipe.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True
+        ))
+        # Связи пользователя меняются только под блокировкой его строки,
+        # поэтому вставка ниже добавит ровно added: конфликтов с
+        # параллельными запросами не будет, и счетчики сойдутся.
+        lock_authors([user.pk])
+        linked = set(model.objects.filter(
+            author=user, recipe_id__in=found
+        ).values_list('recipe_id', flat=True))
+        added = found - linked
+        model.objects.bulk_create(
+            (model(author=user, recipe_id=pk) for pk in added),
+            ignore_conflicts=True,
+        )
+        # bulk_create не отправляет post_save, счетчики - здесь.
+        self.update_counter(model, added, 1)
+        if model is ShoppingList and added:
+            ShoppingListIngredient.objects.add_recipes(user.pk, added)
+        return Response({'results': [
+            {
+                'id': pk,
+                'status': (
+                    'added' if pk in added
+                    else 'exists' if pk in linked
+                    else 'not_found'
+                ),
+            }
+            for pk in ids
+        ]})
+
+    @transaction.atomic
+    def bulk_delete_connections(self, model, user, ids):
+        lock_authors([user.pk])
+        connections = model.objects.filter(author=user, recipe_id__in=ids)
+        removed = set(connections.values_list('recipe_id', flat=True))
+        connections.delete()
+        return Response({'results': [
+            {'id': pk, 'status': 'removed' if pk in removed else 'missing'}
+            for pk in ids
+        ]})
+
     @action(detail=True, methods=('POST', 'DELETE'),)
     def favorite(self, request, pk=None):
         if request.method == 'POST':
@@ -194,13 +305,60 @@ class RecipeViewSet(viewsets.ModelViewSet):
             ShoppingList, request.user, pk
         )
 
+    @action(detail=False, methods=('POST', 'DELETE'),
+            url_path='favorite', permission_classes=(IsAuthenticated,))
+    def favorite_bulk(self, request):
+        ids = self.get_bulk_ids(request)
+        if request.method == 'POST':
+            return self.bulk_create_connections(Favorites, request.user, ids)
+        return self.bulk_delete_connections(Favorites, request.user, ids)
+
+    @action(detail=False, methods=('POST', 'DELETE'),
+            url_path='shopping_cart', permission_classes=(IsAuthenticated,))
+    def shopping_cart_bulk(self, request):
+        ids = self.get_bulk_ids(request)
+        if request.method == 'POST':
+            return self.bulk_create_connections(
+                ShoppingList, request.user, ids
+            )
+        return self.bulk_delete_connections(ShoppingList, request.user, ids)
+
+    @action(detail=False, methods=('GET',),
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        paginator = paginations.FeedCursorPagination()
+        page = paginator.paginate_queryset(
+            Feed(request.user), request, view=self
+        )
+        serializer = serializers.RecipeListSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=('GET',), pagination_class=None)
+    def match(self, request):
+        ingredients = request.query_params.getlist('ingredients')
+        if not ingredients or not all(i.isdigit() for i in ingredients):
+            return Response(
+                {'errors': 'Укажите id имеющихся ингредиентов!'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), 100) if limit.isdigit() else 10
+        serializer = serializers.RecipeMatchSerializer(
+            match_recipes(request.user, ingredients, limit),
+            context={'request': request},
+            many=True,
+        )
+        return Response(serializer.data)
+
     @action(detail=False,
             methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS,
+            content_negotiation_class=ShoppingListContentNegotiation)
     def download_shopping_cart(self, request):
-        author = CustomUser.objects.get(id=self.request.user.pk)
-
-        return get_shopping_list(self, request, author)
+        return get_shopping_list(request.user, request.accepted_renderer)
 
     def partial_update(self, request, *args, **kwargs):
         kwargs['partial'] = True
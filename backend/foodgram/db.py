@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def use_replica():
+    """Направляет чтения внутри блока на реплику, если она настроена."""
+    token = replica_reads.set(True)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+STICKY_SALT = 'foodgram.db.sticky'
+
+
+def mark_primary(response, user):
+    """Ставит подписанную куку: следующие STICKY_SECONDS чтения
+    пользователя идут в основную базу, какой бы процесс их ни обслужил.
+    """
+    seconds = settings.DATABASE_REPLICA['STICKY_SECONDS']
+    response.set_signed_cookie(
+        settings.DATABASE_REPLICA['STICKY_COOKIE'], str(user.pk),
+        salt=STICKY_SALT, max_age=seconds, httponly=True, samesite='Lax',
+    )
+
+
+def is_primary_only(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    return request.get_signed_cookie(
+        settings.DATABASE_REPLICA['STICKY_COOKIE'], default=None,
+        salt=STICKY_SALT,
+        max_age=settings.DATABASE_REPLICA['STICKY_SECONDS'],
+    ) == str(user.pk)
+
+
+class ReplicaRouter:
+    """Чтения в блоке use_replica() идут на реплику, остальное —
+    на основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ReplicaReadMixin:
+    """Выполняет действия replica_actions вьюсета DRF на реплике.
+
+    Аутентификация и проверка прав идут до переключения, поэтому
+    только что выданный токен читается из основной базы.
+    """
+
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            self.action in self.replica_actions
+            and not is_primary_only(request)
+        ):
+            self.replica_token = replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            replica_reads.reset(token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
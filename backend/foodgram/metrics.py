@@ -0,0 +1,175 @@
+import bisect
+import hmac
+import ipaddress
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in pairs
+    )
+    return '{%s}' % ','.join(f'{name}="{value}"' for name, value in escaped)
+
+
+class Metric:
+    """Метрика процесса с метками; значения хранятся в словаре по
+    кортежу меток. Число рядов ограничено, чтобы случайные метки
+    не раздували память.
+    """
+
+    type = None
+    max_series = 2000
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def get_series(self, labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        series = self.series.get(key)
+        if series is None and len(self.series) < self.max_series:
+            series = self.series.setdefault(key, self.new_series())
+        return series
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        with self.lock:
+            items = sorted(self.series.items())
+            for key, series in items:
+                yield from self.render_series(key, series)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def new_series(self):
+        return [0]
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            series = self.get_series(labels)
+            if series is not None:
+                series[0] += amount
+
+    def render_series(self, key, series):
+        yield f'{self.name}{format_labels(self.labels, key)} {series[0]}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_series(self):
+        # Счетчики по корзинам, затем сумма и общее число наблюдений.
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value, **labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.get_series(labels)
+            if series is not None:
+                if index < len(self.buckets):
+                    series[index] += 1
+                series[-2] += value
+                series[-1] += 1
+
+    def render_series(self, key, series):
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            labels = format_labels(self.labels, key, (('le', bound),))
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = format_labels(self.labels, key, (('le', '+Inf'),))
+        yield f'{self.name}_bucket{labels} {series[-1]}'
+        labels = format_labels(self.labels, key)
+        yield f'{self.name}_sum{labels} {series[-2]}'
+        yield f'{self.name}_count{labels} {series[-1]}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=()):
+        return self.register(
+            Histogram(name, documentation, labels, buckets)
+        )
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def get_client_address(request):
+    """Адрес клиента: последний адрес из X-Forwarded-For, его дописывает
+    nginx; без заголовка запрос пришел в gunicorn напрямую.
+    """
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    address = forwarded.rsplit(',', 1)[-1].strip() or request.META.get(
+        'REMOTE_ADDR', ''
+    )
+    try:
+        return ipaddress.ip_address(address)
+    except ValueError:
+        return None
+
+
+def has_metrics_access(request):
+    """Метрики доступны администраторам, по токену METRICS_TOKEN и с
+    адресов METRICS_ALLOWED_IPS; по умолчанию — только администраторам.
+    """
+    user = getattr(request, 'user', None)
+    if user and user.is_staff:
+        return True
+    token = settings.PROFILING['METRICS_TOKEN']
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(header, f'Bearer {token}'):
+        return True
+    networks = settings.PROFILING['METRICS_ALLOWED_IPS']
+    if not networks:
+        return False
+    address = get_client_address(request)
+    return address is not None and any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in networks
+    )
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus.
+
+    Каждый процесс gunicorn отдает свои значения.
+    """
+    if not has_metrics_access(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
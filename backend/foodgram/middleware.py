@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .db import REPLICA, mark_primary
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|%s|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = tuple(2 ** power for power in range(8, 25, 2))
+
+requests_total = registry.counter(
+    'foodgram_requests_total', 'Profiled requests.',
+    ('view', 'method', 'status'),
+)
+request_duration = registry.histogram(
+    'foodgram_request_duration_seconds', 'Time spent in the view stack.',
+    ('view',), SECONDS_BUCKETS,
+)
+db_queries = registry.histogram(
+    'foodgram_db_queries', 'SQL queries per request.',
+    ('view',), COUNT_BUCKETS,
+)
+db_duration = registry.histogram(
+    'foodgram_db_duration_seconds', 'Total SQL time per request.',
+    ('view',), SECONDS_BUCKETS,
+)
+db_duplicate_queries = registry.histogram(
+    'foodgram_db_duplicate_queries',
+    'Queries per request repeating an earlier query shape.',
+    ('view',), COUNT_BUCKETS,
+)
+duplicate_fingerprints = registry.counter(
+    'foodgram_db_duplicate_fingerprint_total',
+    'Repeated query shapes; SQL for a fingerprint is logged.',
+    ('view', 'fingerprint'),
+)
+render_duration = registry.histogram(
+    'foodgram_render_duration_seconds', 'Response rendering time.',
+    ('view',), SECONDS_BUCKETS,
+)
+response_size = registry.histogram(
+    'foodgram_response_size_bytes', 'Response body size.',
+    ('view',), SIZE_BUCKETS,
+)
+
+
+def fingerprint(sql):
+    shape = IN_LIST_RE.sub('(?)', LITERAL_RE.sub('?', sql))
+    return hashlib.sha1(shape.encode()).hexdigest()[:12], shape
+
+
+class QueryCollector:
+    """Обертка execute_wrapper: время и форма каждого запроса."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.examples = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            key, shape = fingerprint(sql)
+            self.shapes[key] += 1
+            self.examples.setdefault(key, shape)
+
+
+class ProfilingMiddleware:
+    """Профилирует выборку запросов: SQL, повторяющиеся запросы
+    (признак N+1), время рендеринга и размер ответа.
+
+    Результаты уходят в метрики /api/_metrics и, если включено,
+    в заголовок Server-Timing. Для запросов вне выборки цена —
+    один вызов random().
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.PROFILING
+        if not (
+            options['ENABLED']
+            and random.random() < options['SAMPLE_RATE']
+        ):
+            return self.get_response(request)
+
+        collector = QueryCollector()
+        request._profiling_render = [None, 0.0]
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(collector)
+                )
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        self.record(request, response, collector, duration)
+        return response
+
+    def process_template_response(self, request, response):
+        timing = getattr(request, '_profiling_render', None)
+        if timing is not None:
+            timing[0] = time.perf_counter()
+
+            def finish(response):
+                timing[1] = time.perf_counter() - timing[0]
+
+            response.add_post_render_callback(finish)
+        return response
+
+    def record(self, request, response, collector, duration):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        render = request._profiling_render[1]
+        duplicates = sum(
+            count - 1 for count in collector.shapes.values() if count > 1
+        )
+
+        requests_total.inc(
+            view=view, method=request.method, status=response.status_code
+        )
+        request_duration.observe(duration, view=view)
+        db_queries.observe(collector.count, view=view)
+        db_duration.observe(collector.duration, view=view)
+        db_duplicate_queries.observe(duplicates, view=view)
+        render_duration.observe(render, view=view)
+        if not response.streaming:
+            response_size.observe(len(response.content), view=view)
+        for key, count in collector.shapes.items():
+            if count > 1:
+                duplicate_fingerprints.inc(
+                    count - 1, view=view, fingerprint=key
+                )
+                logger.debug(
+                    'Query %s repeated %d times in %s: %s',
+                    key, count, view, collector.examples[key],
+                )
+
+        if settings.PROFILING['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={collector.duration * 1000:.1f};'
+                f'desc="{collector.count} queries, {duplicates} repeated"',
+                f'render;dur={render * 1000:.1f}',
+                f'total;dur={duration * 1000:.1f}',
+            ))
+
+
+class DatabaseMiddleware:
+    """Обслуживает соединения с базой вокруг запроса.
+
+    Перед запросом проверяет постоянные соединения с CONN_HEALTH_CHECKS
+    (как Django 4.1), чтобы разорванное соединение не сорвало запрос.
+    После успешного изменяющего запроса на время привязывает чтения
+    пользователя к основной базе (см. foodgram.db).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for connection in connections.all():
+            if (
+                connection.connection is not None
+                and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.is_usable()
+            ):
+                connection.close()
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if (
+            REPLICA in settings.DATABASES
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and user is not None and user.is_authenticated
+        ):
+            mark_primary(response, user)
+        return response
@@ -0,0 +1,8 @@
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:10000')
+try:
+    workers = int(os.getenv('GUNICORN_WORKERS', '').strip() or 1)
+except ValueError:
+    workers = 1
+wsgi_app = 'foodgram.wsgi:application'
@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.db import transaction
 
-from .models import Ingredient, Recipe, Favorites, ShoppingList, Tag
+from .models import (Ingredient, Recipe, Favorites, ShoppingList,
+                     ShoppingListIngredient, Tag)
 
 
 @admin.register(Tag)
@@ -20,11 +22,22 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time', 'count_in_favorite'
     )
     list_filter = ('tags', 'author', 'name')
-    readonly_fields = ('count_in_favorite',)
+    # Счетчики меняются через F(); сохранение формы со старыми
+    # значениями затерло бы прибавленное за это время.
+    readonly_fields = (
+        'count_in_favorite', 'favorites_count', 'in_carts_count',
+        'ingredients_count', 'popularity', 'trending', 'version',
+        'image_renditions',
+    )
 
     @admin.display(description='Счетчик избранного')
     def count_in_favorite(self, recipe):
-        return recipe.favoriterecipes.count()
+        return recipe.favorites_count
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            Recipe.objects.filter(pk=form.instance.pk).touch()
 
 
 @admin.register(ShoppingList)
@@ -32,8 +45,29 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('author', 'recipe')
     list_filter = list_display
 
+    def get_readonly_fields(self, request, obj=None):
+        # Ингредиенты списка покупок пересчитываются только при
+        # добавлении и удалении рецепта.
+        if obj is not None:
+            return ('author', 'recipe')
+        return super().get_readonly_fields(request, obj)
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            ShoppingListIngredient.objects.add_recipes(
+                obj.author_id, [obj.recipe_id]
+            )
+
 
 @admin.register(Favorites)
 class FavoriteRecipeAdmin(admin.ModelAdmin):
     list_display = ('author', 'recipe')
     list_filter = list_display
+
+
+@admin.register(ShoppingListIngredient)
+class ShoppingListIngredientAdmin(admin.ModelAdmin):
+    list_display = ('author', 'ingredient', 'amount')
+    list_filter = ('author',)
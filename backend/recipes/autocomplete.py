@@ -0,0 +1,101 @@
+import bisect
+import threading
+
+from django.conf import settings
+
+from .catalog import get_catalog_version
+from .models import Ingredient
+
+TRIGRAM_SIZE = 3
+BIGRAM_SIZE = 2
+
+
+def normalize(value):
+    return ' '.join(value.casefold().split())
+
+
+def ngrams(value, size=TRIGRAM_SIZE):
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Сначала отдаются совпадения по началу названия (бинарный поиск
+    по отсортированному списку), затем совпадения по подстроке,
+    кандидаты для которых выбираются по триграммам (для запросов из
+    двух символов — по биграммам). Запросы из одного символа ищутся
+    только по началу названия. Индекс перестраивается при смене
+    версии каталога.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def build(self, version):
+        ingredients = sorted(
+            (
+                Ingredient(id=pk, name=name, measurement_unit=unit)
+                for pk, name, unit in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ).iterator()
+            ),
+            key=lambda ingredient: (normalize(ingredient.name), ingredient.id),
+        )
+        keys = [normalize(ingredient.name) for ingredient in ingredients]
+        grams = {}
+        for position, key in enumerate(keys):
+            for gram in ngrams(key) | ngrams(key, BIGRAM_SIZE):
+                grams.setdefault(gram, set()).add(position)
+        return version, keys, ingredients, grams
+
+    def get_state(self):
+        state = self._state
+        version = get_catalog_version()
+        if state is None or state[0] != version:
+            with self._lock:
+                if self._state is state:
+                    self._state = self.build(version)
+                state = self._state
+        return state
+
+    def search(self, query, limit=None):
+        if limit is None:
+            limit = settings.INGREDIENT_AUTOCOMPLETE['LIMIT']
+        query = normalize(query)
+        if not query:
+            return []
+        _, keys, ingredients, grams = self.get_state()
+
+        start = bisect.bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        results = ingredients[start:min(end, start + limit)]
+        if len(results) >= limit or len(query) < BIGRAM_SIZE:
+            return results
+
+        if len(query) >= TRIGRAM_SIZE:
+            candidates = set.intersection(*(
+                grams.get(gram, set()) for gram in ngrams(query)
+            ))
+        else:
+            candidates = grams.get(query, ())
+        matches = []
+        for position in candidates:
+            if start <= position < end:
+                continue
+            found = keys[position].find(query)
+            if found != -1:
+                word_start = keys[position][found - 1] == ' '
+                matches.append((not word_start, position))
+        matches.sort()
+        results.extend(
+            ingredients[position]
+            for _, position in matches[:limit - len(results)]
+        )
+        return results
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+from .models import CatalogState
+
+
+def get_catalog_cache():
+    return caches['catalog']
+
+
+class CatalogVersion:
+    """Версия справочников из базы, которую процесс перечитывает не чаще
+    раза в CATALOG_VERSION_TIMEOUT секунд.
+
+    Версия в базе видна всем процессам, поэтому импорт в отдельной
+    команде сбрасывает кэши работающего сервера не позже этого срока.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.checked_at = 0.0
+
+    def get(self):
+        with self.lock:
+            if (
+                self.value is not None
+                and time.monotonic() - self.checked_at
+                < settings.CATALOG_VERSION_TIMEOUT
+            ):
+                return self.value
+        state, _ = CatalogState.objects.get_or_create(pk=1)
+        with self.lock:
+            self.value, self.checked_at = state.version, time.monotonic()
+        return state.version
+
+    def bump(self):
+        if not CatalogState.objects.filter(pk=1).update(
+            version=F('version') + 1
+        ):
+            CatalogState.objects.get_or_create(pk=1)
+        # Новая версия читается из базы после коммита изменений.
+        transaction.on_commit(self.reset)
+
+    def reset(self):
+        with self.lock:
+            self.value = None
+
+
+catalog_version = CatalogVersion()
+
+
+def get_catalog_version():
+    return catalog_version.get()
+
+
+def bump_catalog_version():
+    catalog_version.bump()
@@ -0,0 +1,181 @@
+import random
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from users.models import CustomUser, Follow
+
+from .models import Recipe, TimelineEntry
+
+TRIM_SQL = (
+    'DELETE FROM recipes_timelineentry WHERE id IN ('
+    'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+    'PARTITION BY user_id ORDER BY pub_date DESC, recipe_id DESC'
+    ') AS position FROM recipes_timelineentry WHERE user_id IN ({users})'
+    ') AS ranked WHERE position > %s)'
+)
+
+
+def apply_keyset(queryset, cursor, key_field='pub_date', id_field='id'):
+    """Упорядочивает по (ключ, id) по убыванию и оставляет строки
+    после курсора (до него, если курсор обратный).
+    """
+    if cursor is None:
+        return queryset.order_by(f'-{key_field}', f'-{id_field}')
+    key, pk, reverse = cursor
+    if reverse:
+        return queryset.filter(
+            Q(**{f'{key_field}__gt': key})
+            | Q(**{key_field: key, f'{id_field}__gt': pk})
+        ).order_by(key_field, id_field)
+    return queryset.filter(
+        Q(**{f'{key_field}__lt': key})
+        | Q(**{key_field: key, f'{id_field}__lt': pk})
+    ).order_by(f'-{key_field}', f'-{id_field}')
+
+
+def is_fanned_out(author):
+    return author.followers_count <= settings.FEED['FANOUT_LIMIT']
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах пользователей MAX_LENGTH последних записей."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TRIM_SQL.format(users=', '.join(['%s'] * len(user_ids))),
+            [*user_ids, settings.FEED['MAX_LENGTH']],
+        )
+
+
+def fan_out_recipe(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора.
+
+    Ленты обрезаются не при каждой записи, а в среднем раз в
+    TRIM_EVERY раз, поэтому могут ненадолго превышать MAX_LENGTH.
+    """
+    if not is_fanned_out(recipe.author):
+        return
+    follower_ids = list(Follow.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id, recipe=recipe, pub_date=recipe.pub_date
+            )
+            for user_id in follower_ids
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    if random.randrange(settings.FEED['TRIM_EVERY']) == 0:
+        trim_timelines(follower_ids)
+
+
+def get_recent_recipes(author):
+    return Recipe.objects.filter(author=author).order_by(
+        '-pub_date', '-id'
+    ).values_list('pk', 'pub_date')[:settings.FEED['MAX_LENGTH']]
+
+
+def add_author(user, author):
+    """Переносит последние рецепты автора в ленту нового подписчика."""
+    if not is_fanned_out(author):
+        return
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user=user, recipe_id=pk, pub_date=pub_date)
+            for pk, pub_date in get_recent_recipes(author)
+        ),
+        ignore_conflicts=True,
+    )
+    trim_timelines([user.pk])
+
+
+def backfill_author(author):
+    """Переносит последние рецепты автора в ленты всех его подписчиков.
+
+    Пока подписчиков больше FANOUT_LIMIT, рецепты автора не раскладываются
+    по лентам, а подмешиваются при чтении; когда их становится меньше,
+    подмешивание прекращается, и опубликованное за это время нужно
+    перенести в ленты.
+    """
+    recipes = list(get_recent_recipes(author))
+    follower_ids = list(Follow.objects.filter(
+        author=author
+    ).values_list('user_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+            for user_id in follower_ids
+            for pk, pub_date in recipes
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    trim_timelines(follower_ids)
+
+
+def remove_author(user, author):
+    """Убирает рецепты автора из ленты отписавшегося пользователя.
+
+    Вызывается после удаления подписки: если подписчиков у автора стало
+    ровно FANOUT_LIMIT, его рецепты переносятся в ленты остальных.
+    """
+    TimelineEntry.objects.filter(user=user, recipe__author=author).delete()
+    followers_count = CustomUser.objects.filter(pk=author.pk).values_list(
+        'followers_count', flat=True
+    ).first()
+    if followers_count == settings.FEED['FANOUT_LIMIT']:
+        backfill_author(author)
+
+
+def rebuild_timeline(user):
+    TimelineEntry.objects.filter(user=user).delete()
+    authors = CustomUser.objects.filter(
+        author__user=user,
+        followers_count__lte=settings.FEED['FANOUT_LIMIT'],
+    )
+    recipes = Recipe.objects.filter(author__in=authors).order_by(
+        '-pub_date', '-id'
+    ).values_list('pk', 'pub_date')[:settings.FEED['MAX_LENGTH']]
+    TimelineEntry.objects.bulk_create(
+        TimelineEntry(user=user, recipe_id=pk, pub_date=pub_date)
+        for pk, pub_date in recipes
+    )
+
+
+class Feed:
+    """Лента подписок пользователя для keyset-пагинации.
+
+    Рецепты обычных авторов читаются из ленты пользователя, рецепты
+    авторов с большим числом подписчиков — напрямую из рецептов;
+    обе выборки идут по индексу и сливаются в памяти.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def fetch(self, cursor, limit):
+        keys = set(apply_keyset(
+            TimelineEntry.objects.filter(user=self.user),
+            cursor, id_field='recipe_id',
+        ).values_list('pub_date', 'recipe_id')[:limit])
+        popular_authors = list(CustomUser.objects.filter(
+            author__user=self.user,
+            followers_count__gt=settings.FEED['FANOUT_LIMIT'],
+        ).values_list('pk', flat=True))
+        if popular_authors:
+            keys.update(apply_keyset(
+                Recipe.objects.filter(author__in=popular_authors), cursor
+            ).values_list('pub_date', 'id')[:limit])
+        reverse = cursor is not None and cursor[2]
+        keys = sorted(keys, reverse=not reverse)[:limit]
+        recipes = Recipe.objects.with_read_plan(self.user).in_bulk(
+            [pk for _, pk in keys]
+        )
+        return [recipes[pk] for _, pk in keys if pk in recipes]
@@ -0,0 +1,104 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = 'recipes/renditions'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGES['WORKERS'],
+    thread_name_prefix='recipe-images',
+)
+# Одно и то же изображение не обрабатывается двумя потоками сразу.
+locks = [threading.Lock() for _ in range(64)]
+
+
+def get_formats():
+    Image.init()
+    return [
+        image_format for image_format in settings.RECIPE_IMAGES['FORMATS']
+        if image_format.upper() in Image.SAVE
+    ]
+
+
+def get_rendition_paths(image_name):
+    """Пути копий зависят только от имени оригинала, а оно — от хеша
+    содержимого, поэтому одинаковые изображения делят одни копии.
+    """
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return {
+        image_format: {
+            name: f'{RENDITIONS_DIR}/{stem}/{name}.{image_format}'
+            for name in settings.RECIPE_IMAGES['RENDITIONS']
+        }
+        for image_format in get_formats()
+    }
+
+
+def build_renditions(image_name):
+    """Сохраняет недостающие уменьшенные копии изображения.
+
+    Возвращает словарь {формат: {версия: имя файла}}.
+    """
+    renditions = get_rendition_paths(image_name)
+    missing = [
+        (image_format, name, path)
+        for image_format, paths in renditions.items()
+        for name, path in paths.items()
+        if not default_storage.exists(path)
+    ]
+    if not missing:
+        return renditions
+
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(image_name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info
+                              else 'RGB')
+    for image_format, name, path in missing:
+        width = settings.RECIPE_IMAGES['RENDITIONS'][name]
+        rendition = image.copy()
+        rendition.thumbnail((width, width * 4))
+        buffer = io.BytesIO()
+        rendition.save(
+            buffer, image_format.upper(),
+            quality=settings.RECIPE_IMAGES['QUALITY'],
+        )
+        renditions[image_format][name] = default_storage.save(
+            path, ContentFile(buffer.getvalue())
+        )
+    return renditions
+
+
+def process_recipe_image(recipe_id, image_name):
+    try:
+        with locks[hash(image_name) % len(locks)]:
+            renditions = build_renditions(image_name)
+        Recipe.objects.filter(pk=recipe_id, image=image_name).touch(
+            image_renditions=renditions
+        )
+    except Exception:
+        logger.exception('Failed to process image %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(recipe):
+    """Ставит обработку изображения в пул после коммита транзакции."""
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(process_recipe_image, recipe_id, image_name)
+    )
@@ -0,0 +1,240 @@
+import json
+import math
+import platform
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import django
+from django.db import connection
+from django.db.models import Count
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from users.models import CustomUser
+
+from .seed_benchmark_data import USERNAME_PREFIX
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_benchmark_user():
+    """Пользователь seed_benchmark_data с наибольшим числом подписок."""
+    user = CustomUser.objects.filter(
+        username__startswith=USERNAME_PREFIX
+    ).annotate(
+        follows=Count('follower')
+    ).order_by('-follows', 'pk').first()
+    if user is None:
+        raise CommandError('Run seed_benchmark_data first')
+    return user
+
+
+def get_endpoints(user):
+    recipe_ids = list(Recipe.objects.order_by('?').values_list(
+        'pk', flat=True
+    )[:100])
+    pages = max(Recipe.objects.count() // 6, 1)
+    author_id = user.follower.values_list('author_id', flat=True).first()
+    return {
+        'recipes_list': lambda i: '/api/recipes/',
+        'recipes_list_deep': lambda i: f'/api/recipes/?page={pages // 2}',
+        'recipes_list_cursor': lambda i: '/api/recipes/?pagination=cursor',
+        'recipes_filtered': (
+            lambda i: '/api/recipes/?is_favorited=1&tags=breakfast'
+        ),
+        'recipes_by_author': (
+            lambda i: f'/api/recipes/?author={author_id or user.pk}'
+        ),
+        'recipes_search': lambda i: '/api/recipes/?search=суп',
+        'recipe_detail': (
+            lambda i: f'/api/recipes/{recipe_ids[i % len(recipe_ids)]}/'
+        ),
+        'subscriptions': (
+            lambda i: '/api/users/subscriptions/?recipes_limit=3'
+        ),
+        'download_shopping_cart': (
+            lambda i: '/api/recipes/download_shopping_cart/'
+        ),
+    }
+
+
+class HTTPClient:
+    """Клиент для замеров работающего сервера."""
+
+    def __init__(self, base_url, token):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+
+    def get(self, path):
+        request = urllib.request.Request(
+            self.base_url + urllib.parse.quote(path, safe='/?&='),
+            headers={'Authorization': f'Token {self.token}'},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure latency percentiles, queries per request and throughput '
+        'of the main API endpoints with the Django test client, or of a '
+        'running server with --base-url'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--output', help='Write results to a JSON file')
+        parser.add_argument('--compare',
+                            help='Previous results file to compare with')
+        parser.add_argument('--base-url',
+                            help='Measure a running server over HTTP, '
+                                 'e.g. http://127.0.0.1:10000')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Parallel connections with --base-url')
+
+    def measure(self, client, path, requests, warmup, concurrency):
+        for i in range(warmup):
+            self.request(client, path(i))
+        started = time.perf_counter()
+        if isinstance(client, HTTPClient):
+            with ThreadPoolExecutor(concurrency) as executor:
+                samples = list(executor.map(
+                    lambda i: (self.timed_request(client, path(i)), None),
+                    range(requests),
+                ))
+        else:
+            samples = []
+            for i in range(requests):
+                with CaptureQueriesContext(connection) as context:
+                    latency = self.timed_request(client, path(i))
+                samples.append((latency, len(context)))
+        elapsed = time.perf_counter() - started
+        latencies = [latency for latency, _ in samples]
+        queries = [count for _, count in samples if count is not None]
+        return {
+            'requests': requests,
+            'concurrency': concurrency,
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p90_ms': round(percentile(latencies, 0.9), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(max(latencies), 2),
+            'queries': max(queries) if queries else None,
+            'throughput_rps': round(requests / elapsed, 1),
+        }
+
+    def timed_request(self, client, path):
+        started = time.perf_counter()
+        self.request(client, path)
+        return (time.perf_counter() - started) * 1000
+
+    def request(self, client, path):
+        if isinstance(client, HTTPClient):
+            status_code = client.get(path)
+        else:
+            response = client.get(path)
+            status_code = response.status_code
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if status_code != 200:
+            raise CommandError(f'{path}: HTTP {status_code}')
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['endpoints']
+        for name, current in results.items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            change = (current['p50_ms'] / before['p50_ms'] - 1) * 100
+            style = (
+                self.style.ERROR if change > 10
+                else self.style.SUCCESS if change < -10
+                else str
+            )
+            self.stdout.write(style(
+                f'{name:<24} p50 {before["p50_ms"]:>8.2f} -> '
+                f'{current["p50_ms"]:>8.2f} ms ({change:+.0f}%), '
+                f'rps {before["throughput_rps"]} -> '
+                f'{current["throughput_rps"]}, '
+                f'queries {before["queries"]} -> {current["queries"]}'
+            ))
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be positive')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be positive')
+        if options['concurrency'] > 1 and not options['base_url']:
+            raise CommandError('--concurrency requires --base-url')
+        user = get_benchmark_user()
+        token, _ = Token.objects.get_or_create(user=user)
+        if options['base_url']:
+            client = HTTPClient(options['base_url'], token.key)
+        else:
+            setup_test_environment()
+            client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        try:
+            results = {}
+            for name, path in get_endpoints(user).items():
+                results[name] = self.measure(
+                    client, path, options['requests'], options['warmup'],
+                    options['concurrency'],
+                )
+                self.stderr.write(f'{name}: {results[name]}')
+        finally:
+            if not options['base_url']:
+                teardown_test_environment()
+
+        report = {
+            'meta': {
+                'commit': get_commit(),
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'base_url': options['base_url'],
+                'concurrency': options['concurrency'],
+                'user': user.username,
+                'recipes': Recipe.objects.count(),
+                'users': CustomUser.objects.count(),
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(results, options['compare'])
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from users.models import CustomUser
+
+from .benchmark import get_commit, percentile
+from .seed_benchmark_data import PASSWORD, USERNAME_PREFIX
+
+LOGIN_PATH = '/api/auth/token/login/'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure token logins per second (and per core) with the current '
+        'password hasher and login pool settings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--base-url',
+                            help='Measure a running server over HTTP')
+        parser.add_argument('--output', help='Write results to a JSON file')
+
+    def login(self, client, email):
+        payload = {'email': email, 'password': PASSWORD}
+        if client is None:
+            request = urllib.request.Request(
+                self.base_url + LOGIN_PATH,
+                data=json.dumps(payload).encode(),
+                headers={'Content-Type': 'application/json'},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    return response.status
+            except urllib.error.HTTPError as error:
+                return error.code
+        return client.post(LOGIN_PATH, payload).status_code
+
+    def timed_login(self, email):
+        # Клиент Django не потокобезопасен, у каждого вызова свой.
+        client = None if self.base_url else Client()
+        started = time.perf_counter()
+        status_code = self.login(client, email)
+        return status_code, (time.perf_counter() - started) * 1000
+
+    def handle(self, *args, **options):
+        if options['logins'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--logins and --concurrency must be positive')
+        emails = list(CustomUser.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).order_by('pk').values_list('email', flat=True)[:options['logins']])
+        if not emails:
+            raise CommandError('Run seed_benchmark_data first')
+        self.base_url = (options['base_url'] or '').rstrip('/')
+        if not self.base_url:
+            setup_test_environment()
+        try:
+            # Первый вход пересчитывает хэши под текущий алгоритм.
+            for email in emails:
+                self.timed_login(email)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                samples = list(executor.map(
+                    self.timed_login,
+                    (emails[i % len(emails)]
+                     for i in range(options['logins'])),
+                ))
+            elapsed = time.perf_counter() - started
+        finally:
+            if not self.base_url:
+                teardown_test_environment()
+
+        unexpected = {code for code, _ in samples} - {200, 429}
+        if unexpected:
+            raise CommandError(f'Unexpected HTTP statuses: {unexpected}')
+        latencies = [latency for code, latency in samples if code == 200]
+        accepted = len(latencies)
+        if not latencies:
+            raise CommandError('All logins were rejected with HTTP 429')
+        cores = os.cpu_count() or 1
+        report = {
+            'meta': {
+                'commit': get_commit(),
+                'hasher': settings.PASSWORD_HASHERS[0],
+                'login_workers': settings.PASSWORD_HASHING['LOGIN_WORKERS'],
+                'base_url': options['base_url'],
+                'concurrency': options['concurrency'],
+                'cores': cores,
+            },
+            'logins': options['logins'],
+            'accepted': accepted,
+            'rejected_429': len(samples) - accepted,
+            'logins_per_second': round(accepted / elapsed, 1),
+            'logins_per_second_per_core': round(accepted / elapsed / cores, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p90_ms': round(percentile(latencies, 0.9), 2),
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,85 @@
+import os
+import posixpath
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from recipes.images import RENDITIONS_DIR
+from recipes.models import Recipe
+
+
+def walk_files(storage, directory):
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from walk_files(storage, posixpath.join(directory, name))
+
+
+class Command(BaseCommand):
+    help = 'Delete recipe images and renditions no recipe refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=3600,
+            help='Keep unreferenced files modified less than N seconds ago',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report files that would be deleted',
+        )
+
+    def is_expired(self, storage, name, deadline):
+        return os.path.getmtime(storage.path(name)) < deadline
+
+    def delete(self, storage, name, dry_run):
+        if not dry_run:
+            storage.delete(name)
+        self.stdout.write(f'{"Would delete" if dry_run else "Deleted"} '
+                          f'{name}', self.style.WARNING)
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        references = dict(
+            Recipe.objects.order_by().values('image').annotate(
+                references=Count('pk')
+            ).values_list('image', 'references')
+        )
+        stems = {
+            os.path.splitext(posixpath.basename(name))[0]
+            for name in references
+        }
+        deadline = time.time() - options['grace']
+
+        deleted = 0
+        for name in walk_files(storage, field.upload_to):
+            if (
+                name not in references
+                and self.is_expired(storage, name, deadline)
+            ):
+                self.delete(storage, name, options['dry_run'])
+                deleted += 1
+        for name in walk_files(default_storage, RENDITIONS_DIR):
+            stem = posixpath.basename(posixpath.dirname(name))
+            if (
+                stem not in stems
+                and self.is_expired(default_storage, name, deadline)
+            ):
+                self.delete(default_storage, name, options['dry_run'])
+                deleted += 1
+
+        shared = sum(count - 1 for count in references.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(references)} images referenced by '
+            f'{len(references) + shared} recipes, '
+            f'{deleted} unreferenced files '
+            f'{"found" if options["dry_run"] else "deleted"}'
+        ))
@@ -0,0 +1,53 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.transfer import export_recipes
+
+
+class Command(BaseCommand):
+    help = 'Export recipes to a JSON Lines file (one recipe per line)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='JSON Lines file, "-" for stdout',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Recipes fetched per query',
+        )
+        parser.add_argument(
+            '--embed-images',
+            action='store_true',
+            help='Inline images as base64 data URIs instead of paths',
+        )
+
+    def handle(self, *args, **options):
+        file = (
+            sys.stdout if options['path'] == '-'
+            else open(options['path'], 'w', encoding='utf-8')
+        )
+        started = time.monotonic()
+        total = 0
+        try:
+            for recipe in export_recipes(
+                options['batch_size'], options['embed_images']
+            ):
+                file.write(json.dumps(recipe, ensure_ascii=False) + '\n')
+                total += 1
+                if total % options['batch_size'] == 0:
+                    elapsed = time.monotonic() - started
+                    self.stderr.write(
+                        f'{total} recipes, '
+                        f'{total / max(elapsed, 0.001):.0f}/s',
+                        ending='\r',
+                    )
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        self.stderr.write(self.style.SUCCESS(f'Exported {total} recipes'))
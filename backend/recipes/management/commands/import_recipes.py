@@ -0,0 +1,57 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.transfer import RecipeImporter, batched, read_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from a JSON Lines file (one recipe per line)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='JSON Lines file, "-" for stdin',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Recipes per transaction',
+        )
+        parser.add_argument(
+            '--renditions',
+            action='store_true',
+            help='Build image renditions for imported recipes',
+        )
+
+    def handle(self, *args, **options):
+        importer = RecipeImporter(build_renditions=options['renditions'])
+        file = (
+            sys.stdin if options['path'] == '-'
+            else open(options['path'], encoding='utf-8')
+        )
+        started = time.monotonic()
+        try:
+            with file:
+                for batch in batched(
+                    read_jsonl(file), options['batch_size']
+                ):
+                    importer.import_batch(batch)
+                    self.report(importer, started)
+            importer.finish()
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f'Import failed: {error!r}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.created} new and {importer.updated} '
+            f'updated recipes, skipped {importer.skipped}'
+        ))
+
+    def report(self, importer, started):
+        total = importer.created + importer.updated + importer.skipped
+        elapsed = time.monotonic() - started
+        self.stderr.write(
+            f'{total} recipes, '
+            f'{total / max(elapsed, 0.001):.0f}/s', ending='\r'
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import get_rendition_paths, process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Build missing recipe image renditions'
+
+    def handle(self, *args, **kwargs):
+        rebuilt = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'pk', 'image', 'image_renditions'
+        )
+        for recipe in recipes.iterator():
+            # Пустые копии остаются после перезапуска процесса, другие
+            # форматы и размеры - после смены RECIPE_IMAGES.
+            if recipe.image_renditions != get_rendition_paths(
+                recipe.image.name
+            ):
+                process_recipe_image(recipe.pk, recipe.image.name)
+                rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Renditions rebuilt for {rebuilt} recipes'
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListIngredient
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify aggregated shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare stored shopping lists with carts',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ShoppingListIngredient.objects.rebuild()
+        expected = {
+            (author_id, ingredient_id): amount
+            for author_id, ingredient_id, amount
+            in ShoppingListIngredient.objects.live().iterator()
+        }
+        stored = {
+            (author_id, ingredient_id): amount
+            for author_id, ingredient_id, amount
+            in ShoppingListIngredient.objects.values_list(
+                'author_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        mismatches = [
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        ]
+        for author_id, ingredient_id in mismatches[:20]:
+            self.stderr.write(
+                f'author={author_id} ingredient={ingredient_id}: '
+                f'stored {stored.get((author_id, ingredient_id))}, '
+                f'expected {expected.get((author_id, ingredient_id))}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'{len(mismatches)} shopping list rows are out of sync'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Shopping lists are in sync ({len(stored)} rows)'
+        ))
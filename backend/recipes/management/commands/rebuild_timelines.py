@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import rebuild_timeline
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Rebuild subscription feed timelines from Follow rows'
+
+    def handle(self, *args, **kwargs):
+        users = CustomUser.objects.filter(
+            follower__isnull=False
+        ).distinct().order_by('pk')
+        count = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                rebuild_timeline(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {count} timelines'
+        ))
@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+
+from recipes.models import Favorites, IngredientRecipe, Recipe, ShoppingList
+from users.models import CustomUser, Follow
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized recipe and author counters'
+
+    def recount(self, queryset, counters):
+        actual = queryset.annotate(**{
+            f'actual_{field}': count_subquery(model, related_field)
+            for field, (model, related_field) in counters.items()
+        })
+        drift = Q()
+        for field in counters:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+        drifted = list(actual.filter(drift).values_list('pk', flat=True))
+        if drifted:
+            queryset.filter(pk__in=drifted).update(**{
+                field: count_subquery(model, related_field)
+                for field, (model, related_field) in counters.items()
+            })
+        self.stdout.write(
+            f'{queryset.model._meta.verbose_name_plural}: '
+            f'{len(drifted)} fixed'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        self.recount(Recipe.objects.all(), {
+            'favorites_count': (Favorites, 'recipe'),
+            'in_carts_count': (ShoppingList, 'recipe'),
+            'ingredients_count': (IngredientRecipe, 'recipe'),
+        })
+        self.recount(CustomUser.objects.all(), {
+            'recipes_count': (Recipe, 'author'),
+            'followers_count': (Follow, 'author'),
+        })
+        self.stdout.write(self.style.SUCCESS('Counters recalculated'))
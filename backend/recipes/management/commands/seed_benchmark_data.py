@@ -0,0 +1,209 @@
+import io
+import itertools
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingList, ShoppingListIngredient, Tag)
+from recipes.search import index_recipes
+from users.models import CustomUser, Follow
+
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'benchmark-password'
+WORDS = (
+    'суп', 'салат', 'пирог', 'рагу', 'паста', 'каша', 'омлет', 'плов',
+    'жаркое', 'запеканка', 'быстрый', 'домашний', 'овощной', 'куриный',
+    'острый', 'сырный', 'летний', 'пряный', 'сладкий', 'грибной',
+)
+
+
+def zipf_weights(size, exponent=1.1):
+    """Веса популярности: немногие авторы и рецепты собирают большую
+    часть подписок, избранного и корзин.
+    """
+    return list(itertools.accumulate(
+        1 / (rank ** exponent) for rank in range(1, size + 1)
+    ))
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic dataset for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Average subscriptions per user')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Average favorites per user')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Average shopping cart size per user')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def bulk_create(self, model, objects):
+        """Вставляет объекты и возвращает их id в порядке вставки."""
+        last = model.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return list(model.objects.filter(pk__gt=last).order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+
+    def sample(self, population, weights, average):
+        count = min(
+            max(int(self.random.expovariate(1 / average)), 0),
+            len(population),
+        )
+        chosen = set()
+        # Ограничение попыток: при сильном перекосе весов выборка без
+        # повторов может не набрать count элементов.
+        for _ in range(count * 3):
+            if len(chosen) == count:
+                break
+            chosen.add(
+                self.random.choices(population, cum_weights=weights)[0]
+            )
+        return chosen
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        return self.bulk_create(CustomUser, (
+            CustomUser(
+                username=f'{USERNAME_PREFIX}{number}',
+                email=f'{USERNAME_PREFIX}{number}@example.com',
+                first_name='Bench',
+                last_name=f'User {number}',
+                password=password,
+            )
+            for number in range(count)
+        ))
+
+    def create_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (200, 120, 40)).save(buffer, 'JPEG')
+        field = Recipe._meta.get_field('image')
+        return field.storage.save(
+            f'{field.upload_to}/bench.jpg', ContentFile(buffer.getvalue())
+        )
+
+    def create_recipes(self, count, user_ids, tag_ids, ingredient_ids):
+        image = self.create_image()
+        author_weights = zipf_weights(len(user_ids), exponent=0.8)
+        recipes = []
+        for number in range(count):
+            recipes.append(Recipe(
+                author_id=self.random.choices(
+                    user_ids, cum_weights=author_weights
+                )[0],
+                name=' '.join(self.random.sample(WORDS, 3)).capitalize(),
+                text=' '.join(self.random.choices(WORDS, k=12)),
+                cooking_time=self.random.randint(5, 180),
+                image=image,
+                ingredients_count=self.random.randint(3, 12),
+            ))
+        recipe_ids = self.bulk_create(Recipe, recipes)
+        # Даты публикации за последние два года, новее у больших id.
+        now = timezone.now()
+        offsets = sorted(
+            (self.random.randint(0, 2 * 365 * 24 * 60) for _ in recipes),
+            reverse=True,
+        )
+        for recipe_id, recipe, offset in zip(recipe_ids, recipes, offsets):
+            recipe.pk = recipe_id
+            recipe.pub_date = now - timedelta(minutes=offset)
+        Recipe.objects.bulk_update(
+            recipes, ('pub_date',), batch_size=self.batch_size
+        )
+
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                )
+                for recipe_id, recipe in zip(recipe_ids, recipes)
+                for ingredient_id in self.random.sample(
+                    ingredient_ids, recipe.ingredients_count
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        recipe_tags = Recipe.tags.through
+        recipe_tags.objects.bulk_create(
+            (
+                recipe_tags(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.random.sample(
+                    tag_ids, self.random.randint(1, min(3, len(tag_ids)))
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        return recipe_ids
+
+    def create_links(self, model, owner_field, target_field, user_ids,
+                     targets, average):
+        weights = zipf_weights(len(targets))
+        model.objects.bulk_create(
+            (
+                model(**{owner_field: user_id, target_field: target_id})
+                for user_id in user_ids
+                for target_id in self.sample(targets, weights, average)
+                if target_id != user_id or model is not Follow
+            ),
+            batch_size=self.batch_size,
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if CustomUser.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).exists():
+            raise CommandError('Benchmark data already exists')
+        tag_ids = sorted(Tag.objects.values_list('pk', flat=True))
+        ingredient_ids = sorted(
+            Ingredient.objects.values_list('pk', flat=True)
+        )
+        if not tag_ids or len(ingredient_ids) < 12:
+            raise CommandError(
+                'Run import_tags and import_ingredients first'
+            )
+
+        user_ids = self.create_users(options['users'])
+        recipe_ids = self.create_recipes(
+            options['recipes'], user_ids, tag_ids, ingredient_ids
+        )
+        self.create_links(
+            Follow, 'user_id', 'author_id', user_ids, user_ids,
+            options['follows'],
+        )
+        self.create_links(
+            Favorites, 'author_id', 'recipe_id', user_ids, recipe_ids,
+            options['favorites'],
+        )
+        self.create_links(
+            ShoppingList, 'author_id', 'recipe_id', user_ids, recipe_ids,
+            options['carts'],
+        )
+
+        call_command('recount', stdout=io.StringIO())
+        ShoppingListIngredient.objects.rebuild()
+        index_recipes(recipe_ids)
+        call_command('rebuild_timelines', stdout=io.StringIO())
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(user_ids)} users and {len(recipe_ids)} recipes '
+            f'(password "{PASSWORD}")'
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.scores import ScoreUpdater
+
+
+class Command(BaseCommand):
+    help = (
+        'Update recipe popularity and trending scores from favorites '
+        'and shopping cart events'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute from scratch (accounts for removed events)',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        computed_at = ScoreUpdater(options['batch_size']).update(
+            full=options['full']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Recipe scores updated as of {computed_at.isoformat()}'
+        ))
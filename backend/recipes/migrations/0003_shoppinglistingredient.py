@@ -0,0 +1,60 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_list_ingredients(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingListIngredient = apps.get_model(
+        'recipes', 'ShoppingListIngredient'
+    )
+    ShoppingListIngredient.objects.bulk_create(
+        (
+            ShoppingListIngredient(
+                author_id=author_id,
+                ingredient_id=ingredient_id,
+                amount=amount,
+            )
+            for author_id, ingredient_id, amount in IngredientRecipe.objects.filter(
+                recipe__shopping_cart_recipe__isnull=False
+            ).values_list(
+                'recipe__shopping_cart_recipe__author', 'ingredient'
+            ).annotate(Sum('amount')).order_by().iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shoppinglistingredients', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shoppinglistingredients', to='recipes.ingredient', verbose_name='Ингредиент')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент из списка покупок',
+                'verbose_name_plural': 'Ингредиенты из списка покупок',
+                'default_related_name': 'shoppinglistingredients',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistingredient',
+            constraint=models.UniqueConstraint(fields=('author', 'ingredient'), name='unique_shopping_list_ingredient'),
+        ),
+        migrations.RunPython(
+            fill_shopping_list_ingredients, migrations.RunPython.noop
+        ),
+    ]
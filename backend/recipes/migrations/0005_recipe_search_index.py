@@ -0,0 +1,71 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:20
+
+from django.conf import settings
+from django.db import migrations
+
+# Схема индекса на момент миграции; модуль recipes.search может
+# меняться, поэтому SQL продублирован здесь.
+CREATE_SQL = {
+    'sqlite': (
+        'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts '
+        'USING fts5(name, ingredients, text, '
+        "tokenize='unicode61 remove_diacritics 2')",
+    ),
+    'postgresql': (
+        'CREATE TABLE IF NOT EXISTS recipes_recipe_fts ('
+        'recipe_id bigint PRIMARY KEY '
+        'REFERENCES recipes_recipe (id) ON DELETE CASCADE, '
+        'document tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_fts_document_idx '
+        'ON recipes_recipe_fts USING gin (document)',
+    ),
+}
+INSERT_SQL = {
+    'sqlite': (
+        'INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) '
+        "SELECT r.id, r.name, COALESCE(group_concat(i.name, ' '), ''), "
+        'r.text '
+        'FROM recipes_recipe r '
+        'LEFT JOIN recipes_ingredientrecipe ir ON ir.recipe_id = r.id '
+        'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+        'GROUP BY r.id, r.name, r.text'
+    ),
+    'postgresql': (
+        'INSERT INTO recipes_recipe_fts (recipe_id, document) '
+        'SELECT r.id, '
+        "setweight(to_tsvector(%s, r.name), 'A') || "
+        'setweight(to_tsvector(%s, '
+        "COALESCE(string_agg(i.name, ' '), '')), 'B') || "
+        "setweight(to_tsvector(%s, r.text), 'C') "
+        'FROM recipes_recipe r '
+        'LEFT JOIN recipes_ingredientrecipe ir ON ir.recipe_id = r.id '
+        'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+        'GROUP BY r.id, r.name, r.text'
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    for sql in CREATE_SQL[vendor]:
+        schema_editor.execute(sql)
+    params = [settings.SEARCH_CONFIG] * 3 if vendor == 'postgresql' else []
+    schema_editor.execute(INSERT_SQL[vendor], params)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_read_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=1, verbose_name='Версия справочников')),
+            ],
+            options={
+                'verbose_name': 'Состояние справочников',
+                'verbose_name_plural': 'Состояние справочников',
+            },
+        ),
+    ]
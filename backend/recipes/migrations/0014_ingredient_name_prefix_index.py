@@ -0,0 +1,40 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:40
+
+from django.db import migrations
+
+# Индекс для поиска ингредиента по началу названия (name__istartswith).
+# Django 3.2 не умеет описать его в Meta.indexes: SQLite сравнивает
+# LIKE без учета регистра и берет только индекс с NOCASE, а PostgreSQL
+# ищет по UPPER(name) LIKE, и индексу нужен класс text_pattern_ops.
+CREATE_SQL = {
+    'sqlite': (
+        'CREATE INDEX IF NOT EXISTS ingredient_name_prefix_idx '
+        'ON recipes_ingredient (name COLLATE NOCASE)'
+    ),
+    'postgresql': (
+        'CREATE INDEX IF NOT EXISTS ingredient_name_prefix_idx '
+        'ON recipes_ingredient ((UPPER(name::text)) text_pattern_ops)'
+    ),
+}
+
+
+def create_prefix_index(apps, schema_editor):
+    sql = CREATE_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_catalog_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
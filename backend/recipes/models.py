@@ -1,10 +1,16 @@
+from collections import defaultdict
+
 from colorfield.fields import ColorField
 
-from django.db import models
-from django.db.models import OuterRef, Exists, constraints
+from django.db import models, transaction
+from django.db.models import (BooleanField, Case, Exists, F, OuterRef,
+                              Prefetch, Sum, Value, When, constraints)
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+
+from users.models import CustomUser, Follow
 
-from users.models import CustomUser
+from .storage import ContentAddressedStorage
 
 
 class Ingredient(models.Model):
@@ -20,6 +26,12 @@ class Ingredient(models.Model):
     )
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=['name', 'measurement_unit'],
+                name='ingredient_name_unit_idx',
+            ),
+        ]
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
@@ -70,6 +82,43 @@ class RecipeQuerySet(models.QuerySet):
             ),
         )
 
+    def with_flags(self, user):
+        """Флаги текущего пользователя: избранное, список покупок
+        и подписка на автора.
+        """
+        if user is None or not user.is_authenticated:
+            false = Value(False, output_field=BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return self.with_annotations(user).annotate(
+            author_is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('author'))
+            ),
+        )
+
+    def with_read_plan(self, user):
+        """Все, что нужно RecipeListSerializer, за фиксированное число
+        запросов: автор, теги, ингредиенты и флаги текущего пользователя.
+        """
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredientrecipes',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        ).with_flags(user)
+
+    def touch(self, **fields):
+        """Обновляет поля и увеличивает версию рецептов."""
+        return self.update(
+            version=F('version') + 1, updated_at=timezone.now(), **fields
+        )
+
 
 class RecipeManager(models.Manager):
 
@@ -134,9 +183,16 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         upload_to='recipes/images',
+        storage=ContentAddressedStorage(),
         verbose_name='Изображение',
     )
 
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Уменьшенные копии изображения',
+    )
+
     text = models.CharField(
         max_length=150,
         verbose_name='Описание рецепта',
@@ -169,8 +225,61 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
     )
 
+    favorites_count = models.IntegerField(
+        default=0,
+        verbose_name='Добавлений в избранное',
+    )
+
+    in_carts_count = models.IntegerField(
+        default=0,
+        verbose_name='Добавлений в список покупок',
+    )
+
+    ingredients_count = models.IntegerField(
+        default=0,
+        verbose_name='Количество ингредиентов',
+    )
+
+    popularity = models.FloatField(
+        default=0,
+        verbose_name='Популярность',
+    )
+
+    trending = models.FloatField(
+        default=0,
+        verbose_name='Популярность за последние дни',
+    )
+
+    version = models.PositiveIntegerField(
+        default=1,
+        verbose_name='Версия рецепта',
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['-popularity', '-id'],
+                name='recipe_popularity_idx',
+            ),
+            models.Index(
+                fields=['-trending', '-id'],
+                name='recipe_trending_idx',
+            ),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -181,8 +290,33 @@ class Recipe(models.Model):
         return self.name
 
 
+class ShoppingListQuerySet(models.QuerySet):
+
+    @transaction.atomic
+    def delete(self):
+        """Удаляет рецепты из списков покупок вместе с их ингредиентами
+        в ShoppingListIngredient.
+        """
+        lock_authors(self.values_list('author_id', flat=True))
+        # Строки перечитываются под блокировкой: параллельное удаление
+        # тех же рецептов не должно вычесть их ингредиенты дважды.
+        recipes_by_author = defaultdict(list)
+        for author_id, recipe_id in self.values_list(
+            'author_id', 'recipe_id'
+        ):
+            recipes_by_author[author_id].append(recipe_id)
+        result = super().delete()
+        for author_id, recipe_ids in recipes_by_author.items():
+            ShoppingListIngredient.objects.remove_recipes(
+                author_id, recipe_ids
+            )
+        return result
+
+
 class ShoppingList(models.Model):
 
+    objects = ShoppingListQuerySet.as_manager()
+
     author = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
@@ -197,6 +331,12 @@ class ShoppingList(models.Model):
         verbose_name='Рецепт',
     )
 
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления',
+    )
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -211,6 +351,9 @@ class ShoppingList(models.Model):
     def __str__(self):
         return f'{self.user} добавил: {self.recipe}'
 
+    def delete(self, *args, **kwargs):
+        return ShoppingList.objects.filter(pk=self.pk).delete()
+
 
 class Favorites(models.Model):
 
@@ -226,6 +369,12 @@ class Favorites(models.Model):
         verbose_name='Рецепт',
     )
 
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления',
+    )
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -238,3 +387,205 @@ class Favorites(models.Model):
 
     def __str__(self):
         return self.recipe
+
+
+class RecipeScoreState(models.Model):
+    """Момент, на который пересчитаны popularity и trending."""
+
+    computed_at = models.DateTimeField(
+        verbose_name='Время пересчета',
+    )
+
+    class Meta:
+        verbose_name = 'Состояние рейтингов'
+        verbose_name_plural = 'Состояние рейтингов'
+
+
+class CatalogState(models.Model):
+    """Версия справочников тегов и ингредиентов, общая для всех
+    процессов сервера.
+    """
+
+    version = models.BigIntegerField(
+        default=1,
+        verbose_name='Версия справочников',
+    )
+
+    class Meta:
+        verbose_name = 'Состояние справочников'
+        verbose_name_plural = 'Состояние справочников'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика автора; дата публикации скопирована,
+    чтобы лента читалась одним проходом по индексу.
+    """
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+    )
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx',
+            )
+        ]
+        default_related_name = 'timelineentries'
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
+
+
+def lock_authors(author_ids):
+    """Блокирует строки пользователей до конца транзакции: изменения
+    списков покупок одного пользователя выполняются по очереди.
+    """
+    list(CustomUser.objects.select_for_update().filter(
+        pk__in=list(author_ids)
+    ).order_by('pk').values_list('pk', flat=True))
+
+
+def get_recipe_amounts(recipes):
+    return dict(
+        IngredientRecipe.objects.filter(
+            recipe__in=recipes
+        ).values_list('ingredient_id').annotate(Sum('amount'))
+    )
+
+
+class ShoppingListIngredientQuerySet(models.QuerySet):
+
+    @transaction.atomic
+    def apply_deltas(self, author_ids, deltas):
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        author_ids = list(author_ids)
+        if not deltas or not author_ids:
+            return
+        lock_authors(author_ids)
+        rows = self.filter(
+            author_id__in=author_ids, ingredient_id__in=deltas
+        )
+        existing = set(rows.values_list('author_id', 'ingredient_id'))
+        rows.update(amount=F('amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ),
+            default=Value(0),
+        ))
+        self.bulk_create(
+            ShoppingListIngredient(
+                author_id=author_id,
+                ingredient_id=ingredient_id,
+                amount=delta,
+            )
+            for author_id in author_ids
+            for ingredient_id, delta in deltas.items()
+            if delta > 0 and (author_id, ingredient_id) not in existing
+        )
+        rows.filter(amount__lte=0).delete()
+
+    def add_recipes(self, author_id, recipes):
+        self.apply_deltas([author_id], get_recipe_amounts(recipes))
+
+    def remove_recipes(self, author_id, recipes):
+        self.apply_deltas([author_id], {
+            ingredient_id: -amount
+            for ingredient_id, amount in get_recipe_amounts(recipes).items()
+        })
+
+    def update_recipe(self, recipe, old_amounts, new_amounts):
+        self.apply_deltas(
+            ShoppingList.objects.filter(
+                recipe=recipe
+            ).values_list('author_id', flat=True),
+            {
+                ingredient_id: (
+                    new_amounts.get(ingredient_id, 0)
+                    - old_amounts.get(ingredient_id, 0)
+                )
+                for ingredient_id in old_amounts.keys() | new_amounts.keys()
+            },
+        )
+
+    def live(self):
+        return IngredientRecipe.objects.filter(
+            recipe__shopping_cart_recipe__isnull=False
+        ).values_list(
+            'recipe__shopping_cart_recipe__author', 'ingredient'
+        ).annotate(Sum('amount')).order_by()
+
+    @transaction.atomic
+    def rebuild(self):
+        self.all().delete()
+        self.bulk_create(
+            (
+                ShoppingListIngredient(
+                    author_id=author_id,
+                    ingredient_id=ingredient_id,
+                    amount=amount,
+                )
+                for author_id, ingredient_id, amount in self.live().iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class ShoppingListIngredient(models.Model):
+
+    objects = ShoppingListIngredientQuerySet.as_manager()
+
+    author = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+    )
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+
+    amount = models.IntegerField(
+        verbose_name='Количество',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['author', 'ingredient'],
+                name='unique_shopping_list_ingredient'
+            )
+        ]
+        default_related_name = 'shoppinglistingredients'
+        verbose_name = 'Ингредиент из списка покупок'
+        verbose_name_plural = 'Ингредиенты из списка покупок'
+
+    def __str__(self):
+        return f'{self.author}: {self.ingredient} {self.amount}'
@@ -0,0 +1,112 @@
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from .models import Favorites, Recipe, RecipeScoreState, ShoppingList
+from .transfer import batched
+
+EVENT_MODELS = {
+    'favorites': Favorites,
+    'shopping_list': ShoppingList,
+}
+SCORE_FIELDS = ('popularity', 'trending')
+
+
+def get_decay(field, seconds):
+    half_life = settings.RECIPE_SCORES[field]['HALF_LIFE'].total_seconds()
+    return math.exp(-math.log(2) * seconds / half_life)
+
+
+def get_weight(field, key, created, now):
+    """Вклад события в оценку на момент now."""
+    return settings.RECIPE_SCORES['WEIGHTS'][key] * get_decay(
+        field, (now - created).total_seconds()
+    )
+
+
+class ScoreUpdater:
+    """Пересчитывает popularity и trending рецептов.
+
+    Оценка — сумма весов событий (избранное, список покупок) за окно
+    WINDOW с экспоненциальным затуханием. При инкрементальном пересчете
+    старые оценки умножаются на общий множитель затухания, затем
+    прибавляются события после прошлого пересчета и вычитаются события,
+    вышедшие за окно. Удаленные события учитывает только полный
+    пересчет.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.deltas = {}
+
+    def add_events(self, field, start, end, now, sign):
+        for key, model in EVENT_MODELS.items():
+            events = model.objects.filter(created__gt=start, created__lte=end)
+            for recipe_id, created in events.values_list(
+                'recipe_id', 'created'
+            ).iterator():
+                deltas = self.deltas.setdefault(recipe_id, {})
+                deltas[field] = deltas.get(field, 0) + sign * get_weight(
+                    field, key, created, now
+                )
+
+    def apply_deltas(self):
+        for batch in batched(self.deltas.items(), self.batch_size):
+            Recipe.objects.filter(
+                pk__in=[recipe_id for recipe_id, _ in batch]
+            ).update(**{
+                field: F(field) + Case(
+                    *(
+                        When(pk=recipe_id, then=Value(deltas[field]))
+                        for recipe_id, deltas in batch if field in deltas
+                    ),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                )
+                for field in SCORE_FIELDS
+            })
+        self.deltas = {}
+
+    @transaction.atomic
+    def update(self, full=False):
+        now = timezone.now()
+        state = RecipeScoreState.objects.select_for_update().first()
+        if state is None:
+            state = RecipeScoreState(computed_at=now)
+            full = True
+        previous = state.computed_at
+
+        if full:
+            Recipe.objects.exclude(popularity=0, trending=0).update(
+                popularity=0, trending=0
+            )
+        for field in SCORE_FIELDS:
+            window = settings.RECIPE_SCORES[field]['WINDOW']
+            if full:
+                self.add_events(field, now - window, now, now, 1)
+                continue
+            Recipe.objects.filter(**{f'{field}__gt': 0}).update(**{
+                field: F(field) * get_decay(
+                    field, (now - previous).total_seconds()
+                )
+            })
+            self.add_events(field, max(previous, now - window), now, now, 1)
+            # Вычитаются только события, учтенные в прошлый раз.
+            expired_until = min(previous, now - window)
+            if expired_until > previous - window:
+                self.add_events(
+                    field, previous - window, expired_until, now, -1
+                )
+        self.apply_deltas()
+        for field in SCORE_FIELDS:
+            # Погрешность вычитания не должна давать отрицательных оценок.
+            Recipe.objects.filter(**{f'{field}__lt': 1e-9}).exclude(
+                **{field: 0}
+            ).update(**{field: 0})
+
+        state.computed_at = now
+        state.save()
+        return now
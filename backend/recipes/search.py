@@ -0,0 +1,173 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'recipes_recipe_fts'
+WORD_RE = re.compile(r'\w+')
+
+
+def get_words(query):
+    return WORD_RE.findall(query.casefold())
+
+
+class SQLiteSearchBackend:
+    """Индекс FTS5: виртуальная таблица с rowid, равным id рецепта."""
+
+    create_sql = (
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+        'USING fts5(name, ingredients, text, '
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    drop_sql = f'DROP TABLE IF EXISTS {SEARCH_TABLE}'
+    insert_sql = (
+        f'INSERT INTO {SEARCH_TABLE} (rowid, name, ingredients, text) '
+        'SELECT r.id, r.name, COALESCE(group_concat(i.name, \' \'), \'\'), '
+        'r.text '
+        'FROM recipes_recipe r '
+        'LEFT JOIN recipes_ingredientrecipe ir ON ir.recipe_id = r.id '
+        'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+        '{where} GROUP BY r.id, r.name, r.text'
+    )
+    delete_sql = f'DELETE FROM {SEARCH_TABLE} {{where}}'
+    id_column = 'rowid'
+
+    def get_insert_params(self):
+        return []
+
+    def execute(self, cursor, sql, column, ids, params=()):
+        where = ''
+        if ids is not None:
+            where = f'WHERE {column} IN ({", ".join(["%s"] * len(ids))})'
+            params = [*params, *ids]
+        cursor.execute(sql.format(where=where), params)
+
+    def index(self, cursor, ids):
+        self.execute(cursor, self.delete_sql, self.id_column, ids)
+        self.execute(
+            cursor, self.insert_sql, 'r.id', ids, self.get_insert_params()
+        )
+
+    def remove(self, cursor, ids):
+        self.execute(cursor, self.delete_sql, self.id_column, ids)
+
+    def get_match(self, query):
+        return ' '.join(f'"{word}"*' for word in get_words(query))
+
+    def filter(self, queryset, query):
+        # Соединение с таблицей FTS: bm25 считается за один проход
+        # MATCH, а не отдельным подзапросом MATCH для каждой строки.
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[
+                f'{SEARCH_TABLE}.rowid = "{table}"."id"',
+                f'{SEARCH_TABLE} MATCH %s',
+            ],
+            params=[self.get_match(query)],
+            select={
+                'search_rank': f'-bm25({SEARCH_TABLE}, 10.0, 4.0, 1.0)',
+            },
+        ).order_by('-search_rank', '-pub_date')
+
+
+class PostgreSQLSearchBackend(SQLiteSearchBackend):
+    """Таблица с tsvector и GIN-индексом, веса A/B/C для названия,
+    ингредиентов и описания.
+    """
+
+    create_sql = (
+        f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+        'recipe_id bigint PRIMARY KEY '
+        'REFERENCES recipes_recipe (id) ON DELETE CASCADE, '
+        'document tsvector NOT NULL); '
+        f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx '
+        f'ON {SEARCH_TABLE} USING gin (document)'
+    )
+    insert_sql = (
+        f'INSERT INTO {SEARCH_TABLE} (recipe_id, document) '
+        'SELECT r.id, '
+        "setweight(to_tsvector(%s, r.name), 'A') || "
+        'setweight(to_tsvector(%s, '
+        "COALESCE(string_agg(i.name, ' '), '')), 'B') || "
+        "setweight(to_tsvector(%s, r.text), 'C') "
+        'FROM recipes_recipe r '
+        'LEFT JOIN recipes_ingredientrecipe ir ON ir.recipe_id = r.id '
+        'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+        '{where} GROUP BY r.id, r.name, r.text'
+    )
+    id_column = 'recipe_id'
+
+    def get_insert_params(self):
+        return [settings.SEARCH_CONFIG] * 3
+
+    def get_match(self, query):
+        return ' & '.join(f'{word}:*' for word in get_words(query))
+
+    def filter(self, queryset, query):
+        match = self.get_match(query)
+        config = settings.SEARCH_CONFIG
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT recipe_id FROM {SEARCH_TABLE} '
+            'WHERE document @@ to_tsquery(%s, %s)',
+            (config, match),
+        )).annotate(search_rank=RawSQL(
+            f'SELECT ts_rank(document, to_tsquery(%s, %s)) '
+            f'FROM {SEARCH_TABLE} '
+            'WHERE recipe_id = "recipes_recipe"."id"',
+            (config, match),
+        )).order_by('-search_rank', '-pub_date')
+
+
+class FallbackSearchBackend:
+    """Поиск без индекса для остальных СУБД."""
+
+    def filter(self, queryset, query):
+        condition = Q()
+        for word in get_words(query):
+            condition &= (
+                Q(name__icontains=word)
+                | Q(text__icontains=word)
+                | Q(ingredients__name__icontains=word)
+            )
+        return queryset.filter(pk__in=queryset.model.objects.filter(
+            condition
+        ).values('pk'))
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_backend(db_connection=connection):
+    return BACKENDS.get(db_connection.vendor, FallbackSearchBackend)()
+
+
+def index_recipes(ids=None, db_connection=connection):
+    """Переиндексирует рецепты с указанными id (все, если ids=None)."""
+    backend = get_backend(db_connection)
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return
+    if hasattr(backend, 'index'):
+        with db_connection.cursor() as cursor:
+            backend.index(cursor, ids)
+
+
+def remove_recipes(ids, db_connection=connection):
+    backend = get_backend(db_connection)
+    ids = list(ids)
+    if ids and hasattr(backend, 'remove'):
+        with db_connection.cursor() as cursor:
+            backend.remove(cursor, ids)
+
+
+def search_recipes(queryset, query):
+    if not get_words(query):
+        return queryset.none()
+    return get_backend().filter(queryset, query)
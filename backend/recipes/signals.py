@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from users.models import CustomUser, Follow
+
+from .models import (Favorites, Ingredient, Recipe, ShoppingList,
+                     ShoppingListIngredient, Tag, get_recipe_amounts)
+from .search import index_recipes, remove_recipes
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def bump_catalog(**kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(instance, created, **kwargs):
+    if not created:
+        index_recipes(
+            Recipe.objects.filter(
+                ingredients=instance
+            ).values_list('pk', flat=True)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def reindex_recipe(instance, **kwargs):
+    # После коммита: ингредиенты рецепта пишутся после его сохранения.
+    transaction.on_commit(lambda: index_recipes([instance.pk]))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_search(instance, **kwargs):
+    remove_recipes([instance.pk])
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(instance, **kwargs):
+    # До удаления: каскад уберет рецепт из списков покупок в обход
+    # ShoppingListQuerySet.delete, а ингредиенты рецепта еще на месте.
+    ShoppingListIngredient.objects.update_recipe(
+        instance, get_recipe_amounts([instance]), {}
+    )
+
+
+# Счетчики поддерживаются сигналами, поэтому сходятся при любом пути
+# изменения: API, админка, каскадное удаление. Массовые bulk_create и
+# update сигналов не отправляют и обновляют счетчики сами.
+COUNTERS = {
+    Recipe: (CustomUser, 'author_id', 'recipes_count'),
+    Follow: (CustomUser, 'author_id', 'followers_count'),
+    Favorites: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingList: (Recipe, 'recipe_id', 'in_carts_count'),
+}
+
+
+def update_counter(sender, instance, delta):
+    model, key, field = COUNTERS[sender]
+    model.objects.filter(pk=getattr(instance, key)).update(
+        **{field: F(field) + delta}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingList)
+def increment_counter(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        update_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingList)
+def decrement_counter(sender, instance, **kwargs):
+    update_counter(sender, instance, -1)
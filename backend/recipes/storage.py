@@ -0,0 +1,42 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def get_content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — SHA-256 его содержимого.
+
+    Одинаковые загрузки сохраняются один раз, поэтому файл никогда
+    не перезаписывается и может отдаваться с вечным кэшированием.
+    Неиспользуемые файлы удаляет команда collect_recipe_images.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        content_hash = get_content_hash(content)
+        directory, filename = posixpath.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = posixpath.join(
+            directory, content_hash[:2], f'{content_hash}{ext}'
+        )
+        if self.exists(name):
+            # Обновляем mtime, чтобы сборщик не удалил файл, на который
+            # вот-вот сошлётся новая запись.
+            os.utime(self.path(name))
+            return name
+        return self._save(name, content)
@@ -0,0 +1,336 @@
+import base64
+import binascii
+import itertools
+import json
+from collections import Counter
+
+from django.core.files.base import ContentFile
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F, Prefetch
+from django.utils.dateparse import parse_datetime
+
+from users.models import CustomUser
+
+from .catalog import bump_catalog_version
+from .images import schedule_renditions
+from .models import (Ingredient, IngredientRecipe, Recipe, ShoppingList,
+                     ShoppingListIngredient, Tag)
+from .search import index_recipes
+
+
+class TransferError(ValueError):
+    pass
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def upsert_ingredients(rows, batch_size=500):
+    """Создает ингредиенты, которых еще нет. Возвращает их число."""
+    existing = set(
+        Ingredient.objects.values_list('name', 'measurement_unit')
+    )
+    created = 0
+    for batch in batched(rows, batch_size):
+        new = []
+        for row in batch:
+            key = (row['name'], row['measurement_unit'])
+            if key not in existing:
+                existing.add(key)
+                new.append(Ingredient(
+                    name=key[0], measurement_unit=key[1]
+                ))
+        Ingredient.objects.bulk_create(new)
+        created += len(new)
+    if created:
+        bump_catalog_version()
+    return created
+
+
+@transaction.atomic
+def upsert_tags(rows):
+    """Создает и обновляет теги по слагу. Возвращает (создано,
+    обновлено).
+    """
+    existing = {tag.slug: tag for tag in Tag.objects.all()}
+    new, changed = [], []
+    for row in rows:
+        tag = existing.get(row['slug'])
+        if tag is None:
+            tag = existing[row['slug']] = Tag(**row)
+            new.append(tag)
+        elif (tag.name, tag.color) != (row['name'], row['color']):
+            tag.name, tag.color = row['name'], row['color']
+            changed.append(tag)
+    Tag.objects.bulk_create(new)
+    Tag.objects.bulk_update(changed, ('name', 'color'))
+    if new or changed:
+        bump_catalog_version()
+    return len(new), len(changed)
+
+
+def read_jsonl(file):
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise TransferError(f'line {line_number}: {error}')
+
+
+def encode_image(field_file):
+    with field_file.open('rb') as file:
+        encoded = base64.b64encode(file.read()).decode()
+    ext = field_file.name.rsplit('.', 1)[-1].lower()
+    return f'data:image/{ext};base64,{encoded}'
+
+
+def export_recipes(batch_size=500, embed_images=False):
+    """Генератор словарей рецептов в порядке id, выбираемых пачками."""
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'ingredientrecipes',
+            queryset=IngredientRecipe.objects.select_related('ingredient'),
+        ),
+    ).order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return
+        for recipe in batch:
+            yield {
+                'id': recipe.pk,
+                'author': recipe.author.username,
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'pub_date': recipe.pub_date.isoformat(),
+                'image': (
+                    encode_image(recipe.image) if embed_images
+                    else recipe.image.name
+                ),
+                'tags': [tag.slug for tag in recipe.tags.all()],
+                'ingredients': [
+                    {
+                        'name': item.ingredient.name,
+                        'measurement_unit': item.ingredient.measurement_unit,
+                        'amount': item.amount,
+                    }
+                    for item in recipe.ingredientrecipes.all()
+                ],
+            }
+        last_pk = batch[-1].pk
+
+
+class RecipeImporter:
+    """Загружает рецепты пачками, каждая пачка — одна транзакция.
+
+    Рецепты с id обновляются или создаются с тем же id, без id —
+    создаются. Ингредиенты и теги ищутся по словарям в памяти,
+    недостающие ингредиенты создаются, рецепты с неизвестными
+    авторами или тегами пропускаются. Счетчики, списки покупок и
+    поисковый индекс обновляются в той же транзакции.
+    """
+
+    def __init__(self, build_renditions=False):
+        self.build_renditions = build_renditions
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit
+            in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        }
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.image_field = Recipe._meta.get_field('image')
+        self.explicit_ids = False
+        self.created = self.updated = self.skipped = 0
+
+    def resolve_ingredients(self, records):
+        missing = {
+            (item['name'], item['measurement_unit'])
+            for record in records for item in record['ingredients']
+        } - self.ingredients.keys()
+        if not missing:
+            return
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in missing
+        )
+        self.ingredients.update(
+            ((name, unit), pk) for pk, name, unit
+            in Ingredient.objects.filter(
+                name__in={name for name, _ in missing}
+            ).values_list('id', 'name', 'measurement_unit')
+        )
+        bump_catalog_version()
+
+    def save_image(self, value):
+        if not value.startswith('data:'):
+            return value
+        header, _, encoded = value.partition(';base64,')
+        ext = header.rpartition('/')[2]
+        try:
+            content = base64.b64decode(encoded, validate=True)
+        except binascii.Error:
+            raise TransferError('invalid base64 image')
+        return self.image_field.storage.save(
+            f'{self.image_field.upload_to}/import.{ext}',
+            ContentFile(content),
+        )
+
+    def build(self, record, authors, existing):
+        author_id = authors.get(record['author'])
+        tag_ids = [self.tags.get(slug) for slug in record['tags']]
+        if author_id is None or None in tag_ids:
+            return None
+        amounts = Counter()
+        for item in record['ingredients']:
+            amount = int(item['amount'])
+            if amount < 1:
+                raise TransferError(
+                    f'{record["name"]!r}: amount must be positive'
+                )
+            amounts[self.ingredients[
+                (item['name'], item['measurement_unit'])
+            ]] += amount
+        cooking_time = int(record['cooking_time'])
+        if cooking_time < 1 or not amounts or not tag_ids:
+            raise TransferError(f'{record["name"]!r}: incomplete recipe')
+
+        recipe = Recipe(
+            pk=record.get('id'),
+            author_id=author_id,
+            name=record['name'],
+            text=record['text'],
+            cooking_time=cooking_time,
+            image=self.save_image(record['image']),
+            ingredients_count=len(amounts),
+        )
+        pub_date = record.get('pub_date')
+        recipe.pub_date = parse_datetime(pub_date) if pub_date else None
+        old = existing.get(recipe.pk)
+        if old is not None and old.image.name == recipe.image.name:
+            recipe.image_renditions = old.image_renditions
+        return recipe, set(tag_ids), amounts
+
+    def save_new(self, recipes):
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            # Без RETURNING у bulk_create не узнать id новых строк.
+            for recipe in recipes:
+                recipe.save(force_insert=True)
+
+    @transaction.atomic
+    def import_batch(self, records):
+        self.resolve_ingredients(records)
+        authors = dict(CustomUser.objects.filter(
+            username__in={record['author'] for record in records}
+        ).values_list('username', 'id'))
+        existing = Recipe.objects.filter(pk__in=[
+            record['id'] for record in records if record.get('id')
+        ]).only('pk', 'author_id', 'image', 'image_renditions').in_bulk()
+
+        items = []
+        for record in records:
+            item = self.build(record, authors, existing)
+            if item is None:
+                self.skipped += 1
+            else:
+                items.append(item)
+        if not items:
+            return
+
+        updated = [recipe for recipe, _, _ in items if recipe.pk in existing]
+        created = [
+            recipe for recipe, _, _ in items if recipe.pk not in existing
+        ]
+        self.explicit_ids |= any(recipe.pk for recipe in created)
+        # Только рецепты, которые заменяются целиком: пропущенные записи
+        # не должны терять ингредиенты и теги.
+        updated_ids = [recipe.pk for recipe in updated]
+        in_carts = set(ShoppingList.objects.filter(
+            recipe_id__in=updated_ids
+        ).values_list('recipe_id', flat=True))
+        old_amounts = {}
+        rows = IngredientRecipe.objects.filter(
+            recipe_id__in=in_carts
+        ).values_list('recipe_id', 'ingredient_id', 'amount')
+        for recipe_id, ingredient_id, amount in rows:
+            old_amounts.setdefault(recipe_id, {})[ingredient_id] = amount
+
+        Recipe.objects.bulk_update(updated, (
+            'author', 'name', 'text', 'cooking_time', 'image',
+            'image_renditions', 'ingredients_count',
+        ))
+        Recipe.objects.filter(pk__in=updated_ids).touch()
+        self.save_new(created)
+        # auto_now_add перезаписывает дату при вставке.
+        Recipe.objects.bulk_update(
+            [recipe for recipe in updated + created if recipe.pub_date],
+            ('pub_date',),
+        )
+        IngredientRecipe.objects.filter(recipe_id__in=updated_ids).delete()
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe_id=recipe.pk, ingredient_id=ingredient_id,
+                amount=amount,
+            )
+            for recipe, _, amounts in items
+            for ingredient_id, amount in amounts.items()
+        )
+        recipe_tags = Recipe.tags.through
+        recipe_tags.objects.filter(recipe_id__in=updated_ids).delete()
+        recipe_tags.objects.bulk_create(
+            recipe_tags(recipe_id=recipe.pk, tag_id=tag_id)
+            for recipe, tag_ids, _ in items for tag_id in tag_ids
+        )
+
+        for recipe, _, amounts in items:
+            if recipe.pk in in_carts:
+                ShoppingListIngredient.objects.update_recipe(
+                    recipe, old_amounts.get(recipe.pk, {}), amounts
+                )
+        self.update_recipes_count(created, updated, existing)
+        index_recipes([recipe.pk for recipe, _, _ in items])
+        if self.build_renditions:
+            for recipe, _, _ in items:
+                if not recipe.image_renditions:
+                    schedule_renditions(recipe)
+        self.created += len(created)
+        self.updated += len(updated)
+
+    def update_recipes_count(self, created, updated, existing):
+        deltas = Counter(recipe.author_id for recipe in created)
+        for recipe in updated:
+            old_author_id = existing[recipe.pk].author_id
+            if old_author_id != recipe.author_id:
+                deltas[old_author_id] -= 1
+                deltas[recipe.author_id] += 1
+        by_delta = {}
+        for author_id, delta in deltas.items():
+            by_delta.setdefault(delta, []).append(author_id)
+        for delta, author_ids in by_delta.items():
+            if delta:
+                CustomUser.objects.filter(pk__in=author_ids).update(
+                    recipes_count=F('recipes_count') + delta
+                )
+
+    def finish(self):
+        if not self.explicit_ids:
+            return
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [Recipe]
+            ):
+                cursor.execute(sql)
@@ -5,9 +5,13 @@ from .models import CustomUser, Follow
 
 @admin.register(CustomUser)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'email', 'first_name', 'last_name')
+    list_display = (
+        'id', 'username', 'email', 'first_name', 'last_name',
+        'recipes_count', 'followers_count',
+    )
 
     list_filter = ('email', 'username')
+    readonly_fields = ('recipes_count', 'followers_count')
 
 
 @admin.register(Follow)
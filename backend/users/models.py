@@ -54,6 +54,16 @@ class CustomUser(AbstractUser):
         verbose_name='Роль пользователя',
     )
 
+    recipes_count = models.IntegerField(
+        default=0,
+        verbose_name='Количество рецептов',
+    )
+
+    followers_count = models.IntegerField(
+        default=0,
+        verbose_name='Количество подписчиков',
+    )
+
     @property
     def is_admin(self):
         return self.is_superuser or self.role == self.UserRole.ADMIN
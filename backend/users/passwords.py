@@ -0,0 +1,179 @@
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import fcntl
+except ImportError:  # Windows: слоты действуют только внутри процесса.
+    fcntl = None
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.crypto import get_random_string
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2 с параметрами из настроек PASSWORD_HASHING.
+
+    Хэши с другими параметрами пересчитываются при следующем входе.
+    """
+
+    time_cost = settings.PASSWORD_HASHING['ARGON2_TIME_COST']
+    memory_cost = settings.PASSWORD_HASHING['ARGON2_MEMORY_COST']
+    parallelism = settings.PASSWORD_HASHING['ARGON2_PARALLELISM']
+
+
+class LoginBusy(Exception):
+    """Очередь проверки паролей заполнена."""
+
+
+def setup_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    django.setup()
+
+
+@functools.lru_cache()
+def get_dummy_password():
+    """Хэш для проверки входа несуществующего пользователя."""
+    return hashers.make_password(get_random_string(32))
+
+
+def verify_password(password, encoded):
+    """Проверяет пароль; вторым значением возвращает новый хэш, если
+    хэш нужно пересчитать под текущий основной алгоритм.
+    """
+    updated = []
+    is_correct = hashers.check_password(
+        password, encoded,
+        setter=lambda raw: updated.append(hashers.make_password(raw)),
+    )
+    return is_correct, updated[0] if updated else None
+
+
+class LoginSlots:
+    """Ограничивает число одновременных проверок паролей на всех
+    процессах сервера.
+
+    Слот - файл в каталоге directory, занятый через flock. Блокировка
+    снимается при закрытии файла, в том числе когда процесс падает,
+    поэтому слоты не теряются.
+    """
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+        self.local = threading.BoundedSemaphore(count)
+
+    def acquire(self):
+        """Занимает свободный слот; возвращает None, если их нет."""
+        if fcntl is None:
+            return self.local if self.local.acquire(blocking=False) else None
+        os.makedirs(self.directory, exist_ok=True)
+        for number in range(self.count):
+            fd = os.open(
+                os.path.join(self.directory, f'{number}.lock'),
+                os.O_RDWR | os.O_CREAT, 0o600,
+            )
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def release(self, slot):
+        if slot is self.local:
+            self.local.release()
+        else:
+            os.close(slot)
+
+
+class PasswordChecker:
+    """Проверяет пароли в пуле процессов, не занимая процессор
+    обработчика запросов.
+
+    Одновременно проверяется не больше WORKERS + MAX_PENDING паролей
+    на всех процессах сервера, остальные запросы сразу получают
+    LoginBusy. При WORKERS = 0 пароль проверяется в самом запросе.
+    """
+
+    def __init__(self, workers, max_pending, timeout, slots_dir):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = LoginSlots(slots_dir, max(workers, 1) + max_pending)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: дочерним процессам не нужны соединения с базой
+                # и потоки процесса gunicorn.
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=setup_worker,
+                )
+            return self.executor
+
+    def discard_executor(self, executor):
+        """Убирает сломанный пул; следующая проверка создаст новый.
+
+        Процессы сломанного пула executor завершает сам.
+        """
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+
+    def submit(self, password, encoded):
+        """Отправляет проверку в пул; возвращает пул и future."""
+        executor = self.get_executor()
+        try:
+            return executor, executor.submit(
+                verify_password, password, encoded
+            )
+        except BrokenProcessPool:
+            # Процесс пула упал на прошлой проверке (например, не
+            # хватило памяти под Argon2) - пробуем один раз в новом.
+            self.discard_executor(executor)
+            executor = self.get_executor()
+            return executor, executor.submit(
+                verify_password, password, encoded
+            )
+
+    def check(self, password, encoded):
+        slot = self.slots.acquire()
+        if slot is None:
+            raise LoginBusy
+        release = True
+        try:
+            if not self.workers:
+                return verify_password(password, encoded)
+            executor, future = self.submit(password, encoded)
+            return future.result(self.timeout)
+        except TimeoutError:
+            # Хэш еще считается: слот освобождается, когда он будет
+            # готов, а не когда запрос перестал ждать, иначе после
+            # тайм-аутов пул набирает больше проверок, чем слотов.
+            release = False
+            future.add_done_callback(lambda _: self.slots.release(slot))
+            raise LoginBusy
+        except BrokenProcessPool:
+            self.discard_executor(executor)
+            raise LoginBusy
+        finally:
+            if release:
+                self.slots.release(slot)
+
+
+password_checker = PasswordChecker(
+    workers=settings.PASSWORD_HASHING['LOGIN_WORKERS'],
+    max_pending=settings.PASSWORD_HASHING['LOGIN_MAX_PENDING'],
+    timeout=settings.PASSWORD_HASHING['LOGIN_TIMEOUT'],
+    slots_dir=settings.PASSWORD_HASHING['LOGIN_SLOTS_DIR'],
+)